@@ -1,26 +1,309 @@
-import CAMparser, CAMlexer
+import argparse, collections, io, marshal, sys, threading
+import CAMast, CAMio, CAMcache, CAMprofile, CAMparser, CAMlexer, CAMresolve, CAMvm, CAMtranspiler, CAMoptimize, CAMstepper
 
 
-def main(filePath):
-    filename = filePath
-    text = open(filename).read()
-    tokens = CAMlexer.lex(text)
-    if not tokens:
+# inputs, if given, is what input statements read instead of stdin: see
+# CAMio.provider for what it can be. With cache the parsed program is kept
+# in a .camc file (see CAMcache) and reused while the source is unchanged.
+# With profile the program runs on CAMprofile's stepper whatever the backend,
+# its hot spots are written to stderr, and collapsed stacks to the file
+# collapsed if given.
+def main(filePath, backend='tree', optimize=0, report=False, sink=None, inputs=None, cache=False,
+         cache_dir=None, profile=False, collapsed=None):
+    if sink is None:
+        sink = CAMio.BufferedSink()
+    try:
+        return run_file(filePath, backend, optimize, report, sink, inputs, cache, cache_dir, profile, collapsed)
+    finally:
+        sink.flush()
+
+
+# The tree for a program read from source, or None if it is empty or does
+# not lex or parse
+def compile_program(source, optimize, report, sink):
+    # The lexer raises on an illegal character as the parser pulls tokens
+    try:
+        tokens = CAMlexer.TokenStream(CAMlexer.lex_iter(source))
+        if not tokens:
+            return
+        parse_result = CAMparser.parse(tokens)
+    except RuntimeError as error:
+        sink.write(error)
         return
 
-    parse_result = CAMparser.parse(tokens)
     if not parse_result:
-        print("Parse error!")
+        sink.write("Parse error!")
         return
 
     ast = parse_result.value
-    env = {"printing": []}
-    ast.eval(env)
-    print(ast)
+    if optimize:
+        optimizer = CAMoptimize.Optimizer(optimize)
+        ast = optimizer.run(ast)
+        if report:
+            # On stderr, as profiles are, so it stays out of the program's output
+            sys.stderr.write(optimizer.report() + '\n')
+    return ast
+
+
+# compile_program through the cache. A report needs the passes to run, so it
+# always compiles afresh.
+def cached_program(filePath, optimize, report, sink, cache_dir):
+    with open(filePath, 'rb') as source:
+        data = source.read()
+    if not report:
+        ast = CAMcache.read(filePath, data, optimize, cache_dir)
+        if ast is not None:
+            return ast
+    # Decoded as open() would in text mode
+    ast = compile_program(io.TextIOWrapper(io.BytesIO(data)), optimize, report, sink)
+    if ast is not None:
+        CAMcache.write(filePath, data, ast, optimize, cache_dir)
+    return ast
+
+
+def run_file(filePath, backend, optimize, report, sink, inputs, cache, cache_dir, profile, collapsed):
+    if cache:
+        ast = cached_program(filePath, optimize, report, sink, cache_dir)
+    else:
+        with open(filePath) as source:
+            ast = compile_program(source, optimize, report, sink)
+    if ast is None:
+        return
+    warn_undefined(ast)
+    if profile:
+        env = profile_program(ast, inputs, sink, collapsed)
+    else:
+        env = Program(None, ast, backend, optimize).run(inputs, sink)
+    sink.write(ast)
 
     if __name__ != "__main__":
         return env
 
 
+# Warns on stderr about reads of variables nothing in the program assigns,
+# which fail when they run
+def warn_undefined(ast, stream=None):
+    for name, line, column in CAMresolve.resolve(ast).undefined:
+        where = '' if line is None else 'line %d, column %d: ' % (line, column)
+        (stream or sys.stderr).write('warning: %s%s is read but never assigned\n' % (where, name))
+
+
+def profile_program(ast, inputs, sink, collapsed):
+    env = {"printing": sink}
+    if inputs is not None:
+        env["input"] = CAMio.provider(inputs)
+    machine = CAMprofile.ProfilingMachine(ast, env)
+    try:
+        machine.run()
+    finally:
+        sink.flush()
+        sys.stderr.write(machine.report() + '\n')
+        if collapsed:
+            with open(collapsed, 'w') as stacks:
+                stacks.write(machine.collapsed())
+    return env
+
+
+# A program compiled for one backend, which can be run any number of times,
+# from any number of threads at once
+class Program:
+    def __init__(self, source, ast, backend='python', optimize=0):
+        self.source = source
+        self.ast = ast
+        self.backend = backend
+        self.optimize = optimize
+        self.code = None
+        if backend == 'vm':
+            self.code = CAMvm.compile_ast(ast)
+        elif backend == 'python':
+            self.code = CAMtranspiler.compile_ast(ast)
+            if self.code.code is None:
+                # Too big or deep for Python to compile: run the tree instead
+                self.backend = 'tree'
+        elif backend not in ('tree', 'stepper'):
+            raise RuntimeError('unknown backend: ' + backend)
+        self.size = footprint(self)
+
+    def __repr__(self):
+        return 'Program(%s, -O%d, %d bytes)' % (self.backend, self.optimize, self.size)
+
+    # Runs the program and returns its environment. inputs and sink are as
+    # for main, and env holds variables to start with.
+    def run(self, inputs=None, sink=None, env=None):
+        if env is None:
+            env = {}
+        if sink is not None:
+            env["printing"] = sink
+        if inputs is not None:
+            env["input"] = CAMio.provider(inputs)
+        if self.backend == 'vm':
+            CAMvm.run(self.code, env)
+        elif self.backend == 'python':
+            CAMtranspiler.run(self.code, env)
+        elif self.backend == 'stepper':
+            CAMstepper.run(self.ast, env)
+        else:
+            self.ast.eval(env)
+        return env
+
+
+# A rough count of the bytes a compiled program keeps alive: its tree and
+# source, and the code compiled from them
+def footprint(program):
+    size = tree_size(program.ast) + sys.getsizeof(program.source)
+    if program.backend == 'vm':
+        # The code as an array and as a list, and about a closure per
+        # expression node
+        size += program.code.code.itemsize * len(program.code.code) + sys.getsizeof(program.code.ops) + \
+            tree_size(program.ast)
+    elif program.backend == 'python':
+        size += len(marshal.dumps(program.code.code)) + sys.getsizeof(program.code.source)
+    return size
+
+
+def tree_size(node):
+    size = sys.getsizeof(node) + sys.getsizeof(getattr(node, '__dict__', None))
+    return size + sum(tree_size(child) for child in CAMoptimize.children(node))
+
+
+# Parses and compiles source, raising RuntimeError if it does not parse
+def compile_source(source, backend='python', optimize=0):
+    tokens = CAMlexer.TokenStream(CAMlexer.lex_iter(source))
+    if not tokens:
+        ast = CAMast.BlockStatement([])
+    else:
+        parse_result = CAMparser.parse(tokens)
+        if not parse_result:
+            raise RuntimeError('Parse error!')
+        ast = parse_result.value
+        if optimize:
+            ast = CAMoptimize.optimize(ast, optimize)
+    return Program(source, ast, backend, optimize)
+
+
+# What ProgramCache.resize gets for a limit it is not given
+unchanged = object()
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'currsize', 'maxsize',
+                                                 'bytes', 'maxbytes'])
+
+
+# Compiled programs by source, backend and optimization level, least
+# recently used first. The least recently used are evicted once there are
+# more than maxsize of them or their footprints add up to more than maxbytes;
+# either limit can be None. on_evict, if given, is called with each evicted
+# Program. A program bigger than maxbytes on its own is compiled but not kept.
+class ProgramCache:
+    def __init__(self, maxsize=256, maxbytes=64 << 20, on_evict=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.on_evict = on_evict
+        self.programs = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.programs)
+
+    def get(self, source, backend='python', optimize=0):
+        key = (source, backend, optimize)
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                self.hits += 1
+                return program
+            self.misses += 1
+        # Compiled outside the lock so other threads are not kept waiting; two
+        # threads missing on the same source both compile it
+        program = compile_source(source, backend, optimize)
+        with self.lock:
+            if key not in self.programs and (self.maxbytes is None or program.size <= self.maxbytes):
+                self.programs[key] = program
+                self.bytes += program.size
+                evicted = self.evict()
+            else:
+                evicted = []
+        if self.on_evict is not None:
+            for old in evicted:
+                self.on_evict(old)
+        return program
+
+    # Takes programs off the least recently used end until both limits hold
+    def evict(self):
+        evicted = []
+        while self.programs and ((self.maxsize is not None and len(self.programs) > self.maxsize)
+                                 or (self.maxbytes is not None and self.bytes > self.maxbytes)):
+            key, program = self.programs.popitem(last=False)
+            self.bytes -= program.size
+            self.evictions += 1
+            evicted.append(program)
+        return evicted
+
+    # Sets the limits it is given, None meaning no limit, and keeps the others
+    def resize(self, maxsize=unchanged, maxbytes=unchanged):
+        with self.lock:
+            if maxsize is not unchanged:
+                self.maxsize = maxsize
+            if maxbytes is not unchanged:
+                self.maxbytes = maxbytes
+            evicted = self.evict()
+        if self.on_evict is not None:
+            for old in evicted:
+                self.on_evict(old)
+
+    def clear(self):
+        with self.lock:
+            self.programs.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, len(self.programs), self.maxsize,
+                             self.bytes, self.maxbytes)
+
+
+program_cache = ProgramCache()
+
+
+# Compiles source for backend, reusing the Program already in cache if there
+# is one. cache=None compiles afresh every time.
+def compile(source, backend='python', optimize=0, cache=program_cache):
+    if cache is None:
+        return compile_source(source, backend, optimize)
+    return cache.get(source, backend, optimize)
+
+
+# Runs program, a Program or source to compile as compile does, and returns
+# its environment
+def run(program, inputs=None, sink=None, env=None, backend='python', optimize=0, cache=program_cache):
+    if not isinstance(program, Program):
+        program = compile(program, backend, optimize, cache)
+    return program.run(inputs, sink, env)
+
+
 if __name__ == "__main__":
-    main(input())
+    arguments = argparse.ArgumentParser(description='Run a CAM program.')
+    arguments.add_argument('path', nargs='?', help='the .cam file to run; asked for if not given')
+    arguments.add_argument('-O', dest='optimize', type=int, default=0, choices=sorted(CAMoptimize.levels),
+                           help='optimization level')
+    arguments.add_argument('--backend', default='tree', choices=['tree', 'vm', 'python', 'stepper'])
+    arguments.add_argument('--report', action='store_true', help='write statistics for each optimization pass to stderr')
+    arguments.add_argument('--input', default=None, help='a file for input statements to read instead of stdin')
+    arguments.add_argument('--cache', action='store_true', help='reuse the parsed program while the source is unchanged')
+    arguments.add_argument('--profile', action='store_true',
+                           help='run on the profiling stepper and write the hottest statements to stderr')
+    arguments.add_argument('--collapsed', default=None, help='with --profile, write collapsed stacks for flame '
+                                                             'graph tools to this file')
+    arguments.add_argument('--cache-dir', default=None, help='where to keep cached programs (default: __camcache__ '
+                                                              'next to the source)')
+    options = arguments.parse_args()
+    path = options.path or input()
+    inputs = open(options.input, 'rb') if options.input else None
+    try:
+        main(path, options.backend, options.optimize, options.report, inputs=inputs, cache=options.cache,
+             cache_dir=options.cache_dir, profile=options.profile, collapsed=options.collapsed)
+    finally:
+        if inputs is not None:
+            inputs.close()
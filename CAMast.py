@@ -1,8 +1,19 @@
+import CAMio
 from equality import *
 
 
+# Statements the parser builds have the line and column of their first token
 class Statement(Equality):
-    pass
+    line = None
+    column = None
+
+
+# Gives node, built to stand in for origin, origin's position
+def locate(node, origin):
+    if origin.line is not None and node is not origin:
+        node.line = origin.line
+        node.column = origin.column
+    return node
 
 
 class Aexp(Equality):
@@ -40,6 +51,21 @@ class CompoundStatement(Statement):
         self.second.eval(env)
 
 
+# A flat list of statements run in order. The parser emits these for every
+# statement list, so long programs do not nest and eval, repr and equality
+# never recurse once per statement.
+class BlockStatement(Statement):
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __repr__(self):
+        return 'BlockStatement([%s])' % ', '.join(repr(statement) for statement in self.statements)
+
+    def eval(self, env):
+        for statement in self.statements:
+            statement.eval(env)
+
+
 class PrintStatement(Statement):
     def __init__(self, exp):
         self.exp = exp
@@ -48,7 +74,7 @@ class PrintStatement(Statement):
         return 'PrintStatement({})'.format(self.exp)
 
     def eval(self, env):
-        print(self.exp.eval(env))
+        CAMio.printer(env)(self.exp.eval(env))
 
 
 class InputStatement(Statement):
@@ -59,12 +85,7 @@ class InputStatement(Statement):
         return 'InputStatement(%s)' % (self.name)
 
     def eval(self, env):
-        value = input()
-        try:
-            value = int(value)
-        except:
-            pass
-        env[self.name] = value
+        env[self.name] = CAMio.read_input(env)
 
 
 class IfStatement(Statement):
@@ -171,9 +192,9 @@ class VarExp(Aexp):
         return 'VarExp(%s)' % self.name
 
     def eval(self, env):
-        if self.name in env:
+        try:
             return env[self.name]
-        else:
+        except KeyError:
             raise RuntimeError("Variable not defined: {}".format(self.name))
 
 
@@ -269,3 +290,89 @@ class NotBexp(Bexp):
     def eval(self, env):
         value = self.exp.eval(env)
         return not value
+
+
+# What an invariant has when it has not been evaluated since its loop started
+unset = object()
+
+# Where the values of the invariants of the loops running in an environment
+# are kept, by the id of their InvariantExp. They live in the environment
+# rather than in the tree so that runs of one tree never share them, and the
+# key is not a name a CAM variable can have.
+invariants_key = '<invariants>'
+
+
+# An expression whose variables a loop never assigns. It is evaluated the
+# first time the loop reaches it and then reused until the loop finishes, so
+# it is evaluated at the same point as before and raises the same errors.
+class InvariantExp(Aexp):
+    def __init__(self, exp):
+        self.exp = exp
+
+    def __repr__(self):
+        return 'InvariantExp(%s)' % self.exp
+
+    def eval(self, env):
+        values = env.get(invariants_key)
+        if values is None:
+            return self.exp.eval(env)
+        value = values.get(id(self), unset)
+        if value is unset:
+            value = values[id(self)] = self.exp.eval(env)
+        return value
+
+
+# A loop with invariant expressions in it, which are forgotten each time the
+# loop starts because what they read may have changed since it last ran
+class HoistedLoop(Statement):
+    def __init__(self, loop, invariants):
+        self.loop = loop
+        self.invariants = invariants
+
+    def __repr__(self):
+        return 'HoistedLoop(%s)' % self.loop
+
+    def eval(self, env):
+        values = enter_invariants(self, env)
+        try:
+            self.loop.eval(env)
+        finally:
+            leave_invariants(self, env, values)
+
+
+# Forgets the values of loop's invariants in env as the loop starts, and
+# returns the table they are kept in, or None if an enclosing loop made it
+def enter_invariants(loop, env):
+    values = env.get(invariants_key)
+    created = values is None
+    if created:
+        values = env[invariants_key] = {}
+    for invariant in loop.invariants:
+        values.pop(id(invariant), None)
+    return values if created else None
+
+
+# Forgets them again as the loop finishes, and takes the table out of env
+# if made, what enter_invariants returned, says the loop made it
+def leave_invariants(loop, env, made):
+    values = env.get(invariants_key)
+    if values is not None:
+        for invariant in loop.invariants:
+            values.pop(id(invariant), None)
+    if made is not None:
+        env.pop(invariants_key, None)
+
+
+# A for loop with a plan that runs it without iterating, which runs the loop
+# itself when the plan cannot be sure of giving the same result
+class ReducedLoop(Statement):
+    def __init__(self, loop, plan):
+        self.loop = loop
+        self.plan = plan
+
+    def __repr__(self):
+        return 'ReducedLoop(%s)' % self.loop
+
+    def eval(self, env):
+        if not self.plan.run(env):
+            self.loop.eval(env)
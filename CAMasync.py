@@ -0,0 +1,71 @@
+import asyncio, sys
+import CAMio
+from CAMstepper import Machine, Suspend
+
+# Runs CAM programs as coroutines, so many of them can share one event loop.
+# A program runs on a stepper Machine in slices of slice_steps statements,
+# and every loop iteration is a statement, so a long loop gives way to the
+# other programs between slices. input waits on an async stream instead of
+# blocking, and print output is written to an async sink between slices.
+
+
+# A Machine that suspends at input statements and buffers what it prints
+class AsyncMachine(Machine):
+    def __init__(self, ast, env=None):
+        Machine.__init__(self, ast, env)
+        self.pending_input = None
+        self.printed = []
+
+    def output(self, value):
+        self.printed.append(str(value) + '\n')
+
+    def input_statement(self, node):
+        self.pending_input = node.name
+        raise Suspend()
+
+
+# Converts a line read for an input statement the way input() and
+# CAMio.read_input do
+def input_value(line):
+    if isinstance(line, bytes):
+        line = line.decode()
+    if not line:
+        raise EOFError('EOF when reading a line')
+    if line.endswith('\n'):
+        line = line[:-1]
+    return CAMio.parse_value(line)
+
+
+# Runs ast and returns its environment. stdin needs an async readline(), as
+# an asyncio.StreamReader has, and stdout a write() that takes bytes and an
+# optional async drain(), as an asyncio.StreamWriter has. Without stdout the
+# output goes to sys.stdout.
+async def run_async(ast, stdin=None, stdout=None, env=None, slice_steps=1000):
+    machine = AsyncMachine(ast, env)
+    try:
+        while not machine.run(slice_steps):
+            await flush(machine, stdout)
+            if machine.pending_input is not None:
+                if stdin is None:
+                    raise EOFError('EOF when reading a line')
+                machine.env[machine.pending_input] = input_value(await stdin.readline())
+                machine.pending_input = None
+            else:
+                await asyncio.sleep(0)
+    finally:
+        await flush(machine, stdout)
+    return machine.env
+
+
+async def flush(machine, stdout):
+    if not machine.printed:
+        return
+    text = ''.join(machine.printed)
+    machine.printed = []
+    if stdout is None:
+        sys.stdout.write(text)
+        return
+    stdout.write(text.encode())
+    drain = getattr(stdout, 'drain', None)
+    if drain is not None:
+        await drain()
@@ -0,0 +1,113 @@
+import argparse, functools, glob, json, os, sys, time
+from concurrent import futures
+import CAMio, CAMlexer, CAMparser, CAMstepper
+
+# Runs many .cam files across a pool of worker processes and reports on each
+# as one JSON object per line. Workers are started once and build the grammar
+# before their first job, so each file costs a lex, a parse and a run.
+#
+# Programs run on the stepper in slices of slice_steps statements, and a job
+# that is still running when its timeout passes is stopped between slices.
+# Input statements read the file given as inputs, each program from its
+# start, or raise EOFError when there is none.
+
+slice_steps = 1000
+
+
+def warm_worker():
+    CAMparser.parse(CAMlexer.lex('x = 1; if x < 2 then print x end'))
+
+
+# A JSON-friendly copy of an environment, without its sink and input
+def report_env(env):
+    return {name: value if isinstance(value, (int, float, str)) else repr(value)
+            for name, value in env.items() if name not in ("printing", "input")}
+
+
+def run_file(path, timeout=None, inputs=None):
+    report = {'path': path, 'status': 'ok', 'stdout': '', 'env': {}, 'error': None}
+    timings = report['timings'] = {}
+    start = time.perf_counter()
+    try:
+        with open(path) as source:
+            characters = source.read()
+        tokens = CAMlexer.lex_buffer(characters)
+        lexed = time.perf_counter()
+        timings['lex'] = lexed - start
+        result = CAMparser.parse(tokens)
+        parsed = time.perf_counter()
+        timings['parse'] = parsed - lexed
+        if not result:
+            report['status'] = 'parse error'
+            return report
+        sink = CAMio.CaptureSink()
+        env = {"printing": sink, "input": CAMio.ValueInput(())}
+        if inputs is not None:
+            with open(inputs, 'rb') as source:
+                env["input"] = CAMio.provider(source.read())
+        machine = CAMstepper.Machine(result.value, env)
+        try:
+            while not machine.run(slice_steps):
+                if timeout is not None and time.perf_counter() - parsed > timeout:
+                    report['status'] = 'timeout'
+                    break
+        finally:
+            timings['run'] = time.perf_counter() - parsed
+            report['steps'] = machine.steps
+            report['stdout'] = sink.getvalue()
+            report['env'] = report_env(machine.env)
+    except Exception as error:
+        report['status'] = 'error'
+        report['error'] = '%s: %s' % (error.__class__.__name__, error)
+    finally:
+        timings['total'] = time.perf_counter() - start
+    return report
+
+
+# Expands files, directories (every .cam file under them) and glob patterns
+# into a sorted list of paths
+def find_programs(patterns):
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, '**', '*.cam'), recursive=True))
+        elif os.path.isfile(pattern):
+            paths.add(pattern)
+        else:
+            paths.update(glob.glob(pattern, recursive=True))
+    return sorted(paths)
+
+
+# Runs every program matched by patterns and yields their reports in order
+def run_batch(patterns, workers=None, timeout=None, chunksize=16, inputs=None):
+    paths = find_programs(patterns)
+    job = functools.partial(run_file, timeout=timeout, inputs=inputs)
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=warm_worker) as executor:
+        for report in executor.map(job, paths, chunksize=chunksize):
+            yield report
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Run .cam programs in a pool of worker processes.')
+    parser.add_argument('patterns', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds each program may run for')
+    parser.add_argument('--chunksize', type=int, default=16, help='programs sent to a worker at a time')
+    parser.add_argument('--input', default=None, help='a file for every program\'s input statements to read')
+    parser.add_argument('-o', '--output', default=None, help='JSON lines report (default: stdout)')
+    options = parser.parse_args(arguments)
+    output = open(options.output, 'w') if options.output else sys.stdout
+    counts = {}
+    try:
+        for report in run_batch(options.patterns, options.workers, options.timeout, options.chunksize,
+                                options.input):
+            output.write(json.dumps(report) + '\n')
+            counts[report['status']] = counts.get(report['status'], 0) + 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(', '.join('%d %s' % (count, status) for status, count in sorted(counts.items())), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,729 @@
+import io, re, os, gc, sys, json, time, random, asyncio, argparse, platform, statistics, subprocess, tempfile, tracemalloc
+import CAM, CAMlexer, CAMparser, CAMprofile, CAMvm, CAMtranspiler, CAMoptimize, CAMloops, CAMstepper, CAMasync, CAMbatch, CAMio
+from combinators import *
+
+
+# The original lexer, kept only as a baseline for comparison
+def reference_lex(characters):
+    pos = 0
+    tokens = []
+    while pos < len(characters):
+        match = None
+        for pattern, tag in CAMlexer.tokenExpressions:
+            match = re.compile(pattern).match(characters, pos)
+            if match:
+                if tag:
+                    tokens.append((match.group(0), tag))
+                break
+        if not match:
+            return
+        pos = match.end(0)
+    return tokens
+
+
+# Generates a straight-line program with the given number of statements
+def straight_line_program(statements):
+    lines = []
+    for i in range(statements):
+        if i % 3 == 0:
+            lines.append('# note\nx%d = (x%d + %d) * 2 - 1' % (i, i, i))
+        elif i % 3 == 1:
+            lines.append('s%d = "s" + "t"' % i)
+        else:
+            lines.append('if x%d <= %d and not x%d == 1 then print x%d end' % (i, i, i, i))
+    return ';\n'.join(lines)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_lexer(scales=(500, 1000, 2000, 4000)):
+    print('{:>10} {:>12} {:>12} {:>8}'.format('chars', 'reference', 'lex', 'speedup'))
+    for statements in scales:
+        source = straight_line_program(statements)
+        reference_time, expected = timed(reference_lex, source)
+        lex_time, tokens = timed(CAMlexer.lex, source)
+        if tokens != expected:
+            raise RuntimeError('lexer output differs from the reference lexer')
+        print('{:>10} {:>11.4f}s {:>11.4f}s {:>7.1f}x'.format(
+            len(source), reference_time, lex_time, reference_time / lex_time))
+
+
+def bench_token_memory(statements=4000):
+    report = CAMlexer.lex_buffer(straight_line_program(statements)).memory_report()
+    print('{tokens} tokens: tuple list {tuple_list_bytes} bytes, '
+          'buffer {buffer_bytes} bytes, saved {saved_bytes} bytes'.format(**report))
+
+
+def bench_parallel_lexer(statements=40000, workers=4):
+    source = straight_line_program(statements)
+    serial_time, serial = timed(CAMlexer.lex_buffer, source)
+    parallel_time, parallel = timed(CAMlexer.lex_parallel, source, workers, None, 0)
+    if (serial.tags, serial.starts, serial.ends) != (parallel.tags, parallel.starts, parallel.ends):
+        raise RuntimeError('parallel lexer output differs from the serial lexer')
+    print('{} chars: serial {:.4f}s, {} workers {:.4f}s ({:.1f}x)'.format(
+        len(source), serial_time, workers, parallel_time, serial_time / parallel_time))
+
+
+# Generates an if statement whose condition is nested in depth parentheses
+def nested_condition_program(depth):
+    return 'if ' + '(' * depth + '(x) < 1 and y > 2' + ')' * depth + ' then print x end'
+
+
+def bench_packrat(depths=(8, 16, 24, 32)):
+    print('{:>6} {:>10} {:>10} {:>6} {:>7}'.format('depth', 'plain', 'packrat', 'hits', 'misses'))
+    for depth in depths:
+        tokens = CAMlexer.lex(nested_condition_program(depth))
+        plain_time, plain = timed(CAMparser.parse, tokens)
+        memo = Packrat(tokens)
+        packrat_time, memoized = timed(CAMparser.parse, memo)
+        if plain.value != memoized.value:
+            raise RuntimeError('packrat parse differs from the plain parse')
+        print('{:>6} {:>9.4f}s {:>9.4f}s {:>6} {:>7}'.format(
+            depth, plain_time, packrat_time, memo.hits, memo.misses))
+
+
+def bench_dispatch(statements=2000):
+    tokens = CAMlexer.lex(straight_line_program(statements))
+    grammar = CAMparser.grammar
+    ordered_stmt = Alternate(Alternate(Alternate(CAMparser.assign_stmt(), CAMparser.for_stmt()),
+                                       CAMparser.if_stmt()), CAMparser.print_stmt())
+    ordered = Phrase(ordered_stmt + Rep(CAMparser.keyword(';') + ordered_stmt) ^ CAMparser.process_block)
+    ordered_time, expected = timed(ordered, tokens, 0)
+    dispatch_time, result = timed(grammar, tokens, 0)
+    if not result or result.value != expected.value:
+        raise RuntimeError('dispatching parse differs from ordered choice')
+    print('{} statements: ordered choice {:.4f}s, dispatch {:.4f}s'.format(
+        statements, ordered_time, dispatch_time))
+
+
+corpus = [
+    'x = 3; y = (x + 2) * 4 - 1 / 2; print y',
+    'if (x < 2) or not (y >= 3 and x != 1) then print "yes" else print x end',
+    'while x > 0 do x = x - 1; print x end; for i = 1 to 10 do s = i * i end',
+    'func f do input z; print z end; call f',
+    'if ((x) < 1) then print 1 end; print "a" + "b" * "c"',
+    'if not not x == 1 and y < 2 or z > 3 and (a < b or c < d) then print 1 end',
+    'a = 1 * 2 + 3 * 4 - 5 / 6 / 7; c = (((a)))',
+    'x = 1; y = x + ; z = 2',
+    'print "a" + 1',
+    'if x then y = 1 end',
+    'x = 1;',
+    'if x < 1 then y = 1; else y = 2 end',
+]
+
+
+def random_exp(rng, depth):
+    if depth <= 0 or rng.random() < 0.3:
+        return rng.choice(['1', '42', 'x', 'y'])
+    if rng.random() < 0.2:
+        return '(' + random_exp(rng, depth - 1) + ')'
+    return random_exp(rng, depth - 1) + ' ' + rng.choice('+-*/') + ' ' + random_exp(rng, depth - 1)
+
+
+def random_bexp(rng, depth):
+    choice = rng.random()
+    if depth <= 0 or choice < 0.4:
+        return random_exp(rng, 1) + ' ' + rng.choice(['<', '<=', '>', '>=', '==', '!=']) + ' ' + \
+               random_exp(rng, 1)
+    if choice < 0.55:
+        return 'not ' + random_bexp(rng, depth - 1)
+    if choice < 0.7:
+        return '(' + random_bexp(rng, depth - 1) + ')'
+    return random_bexp(rng, depth - 1) + rng.choice([' and ', ' or ']) + random_bexp(rng, depth - 1)
+
+
+def random_stmt_list(rng, depth):
+    return ';\n'.join(random_stmt(rng, depth) for _ in range(rng.randint(1, 4)))
+
+
+def random_stmt(rng, depth):
+    choice = rng.randrange(8 if depth > 0 else 4)
+    if choice == 0:
+        return 'x = ' + random_exp(rng, 3)
+    if choice == 1:
+        return 'print ' + rng.choice([random_exp(rng, 2), '"s"', '"s" + "t"'])
+    if choice == 2:
+        return 'input y'
+    if choice == 3:
+        return 'call f'
+    if choice == 4:
+        return 'if ' + random_bexp(rng, 2) + ' then ' + random_stmt_list(rng, depth - 1) + \
+               (' else ' + random_stmt_list(rng, depth - 1) if rng.random() < 0.5 else '') + ' end'
+    if choice == 5:
+        return 'while ' + random_bexp(rng, 2) + ' do ' + random_stmt_list(rng, depth - 1) + ' end'
+    if choice == 6:
+        return 'for i = ' + random_exp(rng, 1) + ' to ' + random_exp(rng, 1) + ' do ' + \
+               random_stmt_list(rng, depth - 1) + ' end'
+    return 'func f do ' + random_stmt_list(rng, depth - 1) + ' end'
+
+
+# Generated programs, with some tokens dropped from every other one so that
+# parse failures are covered too
+def random_programs(count, seed=0):
+    rng = random.Random(seed)
+    programs = []
+    for i in range(count):
+        source = random_stmt_list(rng, 3)
+        if i % 2:
+            words = source.split(' ')
+            del words[rng.randrange(len(words))]
+            source = ' '.join(words)
+        programs.append(source)
+    return programs
+
+
+def check_engines(programs):
+    for source in programs:
+        tokens = CAMlexer.lex(source)
+        combinator = CAMparser.parse(tokens)
+        pratt = CAMparser.parse(tokens, engine='pratt')
+        if (combinator and combinator.value, combinator and combinator.pos) != \
+                (pratt and pratt.value, pratt and pratt.pos):
+            raise RuntimeError('parser engines disagree on: ' + source)
+
+
+def bench_engines(statements=150, repeat=20):
+    check_engines(corpus + random_programs(500))
+    tokens = CAMlexer.lex(straight_line_program(statements))
+    combinator_time, _ = timed(lambda: [CAMparser.parse(tokens) for _ in range(repeat)])
+    pratt_time, _ = timed(lambda: [CAMparser.parse(tokens, engine='pratt') for _ in range(repeat)])
+    print('{} statements x {}: combinator {:.4f}s, pratt {:.4f}s, {:.1f}x'.format(
+        statements, repeat, combinator_time, pratt_time, combinator_time / pratt_time))
+
+
+numeric_loop_program = '''
+s = 0; t = 1;
+for i = 0 to %d do
+    s = s + i * i - i / 2;
+    if s > 1000000 then s = s - 1000000 end
+end;
+n = 0;
+while n < %d do n = n + 1; t = t * 3 - 2 * t end
+'''
+
+
+def bench_backends(iterations=20000):
+    ast = CAMparser.parse(CAMlexer.lex(numeric_loop_program % (iterations, iterations))).value
+    tree_env = {}
+    tree_time, _ = timed(ast.eval, tree_env)
+    program = CAMvm.compile_ast(ast)
+    vm_time, vm_env = timed(CAMvm.run, program, {})
+    if tree_env != vm_env:
+        raise RuntimeError('vm result differs from eval')
+    compile_time, compiled = timed(CAMtranspiler.compile_ast, ast)
+    python_time, python_env = timed(CAMtranspiler.run, compiled, {})
+    if tree_env != python_env:
+        raise RuntimeError('transpiled result differs from eval')
+    print('numeric loops x {}: eval {:.4f}s, vm {:.4f}s ({:.1f}x), python {:.4f}s ({:.1f}x, '
+          'compiled in {:.4f}s)'.format(iterations, tree_time, vm_time, tree_time / vm_time,
+                                         python_time, tree_time / python_time, compile_time))
+
+
+invariant_loop_program = '''
+a = 7; b = 3; s = 0; debug = 0;
+for i = 0 to %d do
+    s = s + (a * b - 2 * 3) * i;
+    if debug == 1 and 1 < 0 then print s end;
+    if s > (a + b) * 100000 then s = s - (a + b) * 100000 end
+end
+'''
+
+
+def bench_optimizer(iterations=20000):
+    ast = CAMparser.parse(CAMlexer.lex(invariant_loop_program % iterations)).value
+    optimizer = CAMoptimize.Optimizer(2)
+    optimized = optimizer.run(ast)
+    print(optimizer.report())
+    plain_env, optimized_env = {}, {}
+    plain_time, _ = timed(ast.eval, plain_env)
+    optimized_time, _ = timed(optimized.eval, optimized_env)
+    if plain_env != optimized_env:
+        raise RuntimeError('optimized result differs from eval')
+    print('invariant loop x {}: -O0 {:.4f}s, -O2 {:.4f}s, {:.1f}x'.format(
+        iterations, plain_time, optimized_time, plain_time / optimized_time))
+
+
+reduction_program = '''
+s = 0; t = 0; scale = 3;
+for i = 0 to %d do s = s + i * i - scale * i; last = i * scale end;
+for i = 0 to %d do t = t + i / 4 - 1 end
+'''
+
+
+def bench_loops(iterations=200000):
+    ast = CAMparser.parse(CAMlexer.lex(reduction_program % (iterations, iterations))).value
+    optimized = CAMoptimize.optimize(ast, 2)
+    plain_env, optimized_env = {}, {}
+    plain_time, _ = timed(ast.eval, plain_env)
+    optimized_time, _ = timed(optimized.eval, optimized_env)
+    if plain_env != optimized_env:
+        raise RuntimeError('reduced loops differ from eval')
+    print('reduction loops x {}: -O0 {:.4f}s, -O2 {:.4f}s ({})'.format(
+        iterations, plain_time, optimized_time, 'numpy' if CAMloops.numpy else 'closed form only'))
+
+
+recursive_program = '''
+n = %d; sum = 0;
+func count do sum = sum + n; n = n - 1; if n > 0 then call count end end;
+call count
+'''
+
+
+def bench_stepper(iterations=20000, slice_steps=1000, depth=100000):
+    ast = CAMparser.parse(CAMlexer.lex(numeric_loop_program % (iterations, iterations))).value
+    tree_env = {}
+    tree_time, _ = timed(ast.eval, tree_env)
+    stepper_time, machine = timed(CAMstepper.run, ast)
+    sliced = CAMstepper.Machine(ast)
+    slices = 1
+    while not sliced.run(slice_steps):
+        slices += 1
+    if not tree_env == machine.env == sliced.env:
+        raise RuntimeError('stepper result differs from eval')
+    print('numeric loops x {}: eval {:.4f}s, stepper {:.4f}s, {} slices of {} steps'.format(
+        iterations, tree_time, stepper_time, slices, slice_steps))
+    ast = CAMparser.parse(CAMlexer.lex(recursive_program % depth)).value
+    recursion_time, machine = timed(CAMstepper.run, ast)
+    if machine.env['sum'] != depth * (depth + 1) // 2:
+        raise RuntimeError('deep recursion gave the wrong total')
+    print('recursion {} deep: stepper {:.4f}s'.format(depth, recursion_time))
+
+
+io_program = '''
+sum = 0;
+for k = 0 to 3 do
+    input n;
+    for j = 0 to 200 do sum = sum + n * j end;
+    print sum
+end
+'''
+
+
+# Input that takes latency seconds to arrive, and output that is thrown away
+class SlowInput:
+    def __init__(self, latency, line=b'7\n'):
+        self.latency = latency
+        self.line = line
+
+    async def readline(self):
+        await asyncio.sleep(self.latency)
+        return self.line
+
+
+class NullOutput:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    async def drain(self):
+        pass
+
+
+class SlowInputMachine(CAMstepper.Machine):
+    def __init__(self, ast, latency):
+        CAMstepper.Machine.__init__(self, ast)
+        self.latency = latency
+
+    def read_input(self):
+        time.sleep(self.latency)
+        return 7
+
+    def output(self, value):
+        pass
+
+
+def bench_async(programs=200, latency=0.005):
+    ast = CAMparser.parse(CAMlexer.lex(io_program)).value
+    machines = [SlowInputMachine(ast, latency) for _ in range(programs)]
+    blocking_time, _ = timed(lambda: [machine.run() for machine in machines])
+
+    async def run_all():
+        output = NullOutput()
+        envs = await asyncio.gather(*[CAMasync.run_async(ast, SlowInput(latency), output)
+                                      for _ in range(programs)])
+        return envs, output
+
+    async_time, (envs, output) = timed(asyncio.run, run_all())
+    if any(env != machines[0].env for env in envs) or not output.written:
+        raise RuntimeError('async result differs from the blocking run')
+    print('{} programs with {:.0f}ms input latency: blocking {:.3f}s ({:.0f}/s), '
+          'async {:.3f}s ({:.0f}/s)'.format(programs, latency * 1000, blocking_time, programs / blocking_time,
+                                           async_time, programs / async_time))
+
+
+def bench_batch(programs=400, workers=2, sample=10):
+    with tempfile.TemporaryDirectory() as directory:
+        for i, source in enumerate(random_programs(programs)):
+            with open(os.path.join(directory, 'p%04d.cam' % i), 'w') as program:
+                program.write(source.replace('input y', 'y = 1'))
+        paths = CAMbatch.find_programs([directory])
+        process_time, _ = timed(lambda: [subprocess.run([sys.executable, 'CAM.py', path], capture_output=True)
+                                         for path in paths[:sample]])
+        batch_time, reports = timed(lambda: list(CAMbatch.run_batch([directory], workers, timeout=1)))
+    if len(reports) != programs:
+        raise RuntimeError('batch runner lost programs')
+    print('{} programs: a process each {:.1f}/s, batch of {} workers {:.1f}/s'.format(
+        programs, sample / process_time, workers, programs / batch_time))
+
+
+print_program = 'for i = 0 to {} do print i; print i * 2 end'
+
+
+# A print-heavy loop on the transpiled backend, with unbuffered print() and
+# the sinks all writing to the null device
+def bench_output(iterations=100000):
+    program = CAMtranspiler.compile_ast(CAMparser.parse(CAMlexer.lex(print_program.format(iterations))).value)
+    with open(os.devnull, 'w') as null:
+        stdout = sys.stdout
+        sys.stdout = null
+        try:
+            print_time, _ = timed(CAMtranspiler.run, program, {})
+        finally:
+            sys.stdout = stdout
+        sinks = [('buffered', CAMio.BufferedSink(null)), ('null', CAMio.NullSink())]
+        times = []
+        for name, sink in sinks:
+            elapsed, _ = timed(CAMtranspiler.run, program, {"printing": sink})
+            sink.flush()
+            times.append('{} {:.3f}s'.format(name, elapsed))
+    capture = CAMio.CaptureSink()
+    CAMtranspiler.run(program, {"printing": capture})
+    if len(capture.lines) != 2 * iterations or capture.lines[-1] != str(2 * (iterations - 1)):
+        raise RuntimeError('captured output differs from the program')
+    print('{} lines printed: print() {:.3f}s, {}'.format(2 * iterations, print_time, ', '.join(times)))
+
+
+input_program = 'sum = 0; for i = 0 to {} do input x; sum = sum + x end'
+
+
+# An input-heavy loop on the transpiled backend reading from stdin, a list
+# and a file
+def bench_input(iterations=100000):
+    program = CAMtranspiler.compile_ast(CAMparser.parse(CAMlexer.lex(input_program.format(iterations))).value)
+    lines = [str(i) for i in range(iterations)]
+    text = '\n'.join(lines) + '\n'
+    stdin = sys.stdin
+    sys.stdin = io.StringIO(text)
+    try:
+        stdin_time, env = timed(CAMtranspiler.run, program, {})
+    finally:
+        sys.stdin = stdin
+    times = []
+    with tempfile.TemporaryFile() as source:
+        source.write(text.encode())
+        source.seek(0)
+        for name, inputs in [('list', lines), ('file', source)]:
+            elapsed, result = timed(CAMtranspiler.run, program, {"input": CAMio.provider(inputs)})
+            if result['sum'] != env['sum']:
+                raise RuntimeError('{} input differs from stdin'.format(name))
+            times.append('{} {:.3f}s'.format(name, elapsed))
+    print('{} values read: stdin {:.3f}s, {}'.format(iterations, stdin_time, ', '.join(times)))
+
+
+# Compiling a program with an empty cache, which also writes it, and then
+# with a warm one, against compiling without the cache
+def bench_cache(statements=4000, levels=(0, 2)):
+    sink = CAMio.NullSink()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'program.cam')
+        with open(path, 'w') as program:
+            program.write(straight_line_program(statements))
+        for level in levels:
+            with open(path) as source:
+                plain_time, plain = timed(CAM.compile_program, source, level, False, sink)
+            cold_time, cold = timed(CAM.cached_program, path, level, False, sink, directory)
+            warm_time, warm = timed(CAM.cached_program, path, level, False, sink, directory)
+            if not plain == cold == warm:
+                raise RuntimeError('cached program differs from the source')
+            print('{} statements at -O{}: uncached {:.3f}s, cold cache {:.3f}s, warm cache {:.3f}s ({:.0f}x)'.format(
+                statements, level, plain_time, cold_time, warm_time, plain_time / warm_time))
+
+
+embedded_program = 'input n; sum = 0; for i = 0 to n do sum = sum + i * i end; print sum'
+
+
+# A short script run many times through the embedding API, compiling it
+# every time against reusing the cached Program
+def bench_embedding(runs=5000, backend='python'):
+    sink = CAMio.NullSink()
+    cache = CAM.ProgramCache()
+    compile_time, _ = timed(lambda: [CAM.run(embedded_program, [20], sink, backend=backend, cache=None)
+                                     for _ in range(runs)])
+    cached_time, _ = timed(lambda: [CAM.run(embedded_program, [20], sink, backend=backend, cache=cache)
+                                    for _ in range(runs)])
+    info = cache.info()
+    if info.misses != 1 or info.hits != runs - 1:
+        raise RuntimeError('program cache missed: {}'.format(info))
+    print('{} runs on {}: compiling each time {:.0f}/s, cached {:.0f}/s ({:.0f}x)'.format(
+        runs, backend, runs / compile_time, runs / cached_time, compile_time / cached_time))
+
+
+# The stepper with and without the profiler, on the call-heavy workload
+def bench_profile(iterations=20000):
+    ast = CAMparser.parse(CAMlexer.TokenStream(CAMlexer.lex_iter(call_workload(iterations)))).value
+    plain_time, plain = timed(CAMstepper.run, ast, {})
+    profiled_time, profiled = timed(CAMprofile.profile, ast, {})
+    if plain.env['c'] != profiled.env['c']:
+        raise RuntimeError('profiled run differs from the plain one')
+    hottest = max(profiled.statements.values(), key=lambda stats: stats.self_time)
+    print('{} calls: stepper {:.3f}s, profiled {:.3f}s ({:.1f}x); hottest statement on line {}'.format(
+        2 * iterations, plain_time, profiled_time, profiled_time / plain_time, hottest.node.line))
+
+
+# How much work the grammar redoes on parenthesised conditions, from the
+# rule instrumentation, with and without packrat memoisation
+def bench_grammar(statements=200):
+    tokens = CAMlexer.lex(bexp_workload(statements))
+    for packrat in (False, True):
+        instrumented = Instrumented(tokens, packrat)
+        elapsed, result = timed(CAMparser.parse, instrumented)
+        if not result:
+            raise RuntimeError('workload does not parse')
+        rules = instrumented.rules.values()
+        busiest = max(rules, key=lambda stats: stats.repeats + stats.backtracked)
+        print('{}: {} rule calls, {} repeated, {} tokens backtracked, most by {} ({:.3f}s instrumented)'.format(
+            'packrat' if packrat else 'plain', sum(stats.calls for stats in rules),
+            sum(stats.repeats for stats in rules), sum(stats.backtracked for stats in rules), busiest.name, elapsed))
+
+
+# The benchmark suite: generated workloads at fixed scales, with lexing,
+# parsing and evaluation timed separately and their peak memory measured,
+# written as JSON so runs on different commits can be compared.
+#
+# Every workload is a function from a size to the source of a program that
+# runs without input. Evaluation prints to a NullSink, so output costs
+# nothing but the print statements themselves.
+
+def straight_line_workload(statements):
+    lines = ['x = 1']
+    for i in range(1, statements):
+        if i % 3 == 0:
+            lines.append('x = (x + %d) * 2 - x' % i)
+        elif i % 3 == 1:
+            lines.append('s%d = "s" + "t"' % i)
+        else:
+            lines.append('if x <= %d and not x == 1 then y%d = x end' % (i, i))
+    return ';\n'.join(lines)
+
+
+# Alternating ifs and whiles nested depth deep; each while runs once
+def nested_workload(depth):
+    inner = 'c = c + 1'
+    for level in range(depth, 0, -1):
+        if level % 2:
+            inner = 'if c >= 0 then %s else c = c - 1 end' % inner
+        else:
+            inner = 'w{0} = 0; while w{0} < 1 do w{0} = w{0} + 1; {1} end'.format(level, inner)
+    return 'c = 0;\n' + inner
+
+
+# Conditions of and, or and not nested depth deep in parentheses
+def bexp_workload(statements, depth=6):
+    lines = ['a = 3; b = 4; c = 0']
+    for i in range(statements):
+        condition = 'a < %d' % i
+        for level in range(depth):
+            op = 'and' if (i + level) % 2 else 'or'
+            condition = '(%s %s not (b + %d > %d))' % (condition, op, level, i % 11)
+        lines.append('if %s then c = c + 1 end' % condition)
+    return ';\n'.join(lines)
+
+
+def for_workload(iterations):
+    return 'sum = 0; for i = 0 to %d do sum = sum + (i * 3 - 1) * 2 end' % iterations
+
+
+def print_workload(iterations):
+    return 'for i = 0 to %d do print i; print i * 2 end' % iterations
+
+
+def call_workload(iterations):
+    return ('c = 0;\nfunc f do c = c + 1 end;\nfunc g do call f; call f end;\n'
+            'for i = 0 to %d do call g end' % iterations)
+
+
+workloads = {
+    'straight_line': (straight_line_workload, {'small': 250, 'medium': 1000, 'large': 4000}),
+    'nested': (nested_workload, {'small': 8, 'medium': 16, 'large': 28}),
+    'bexp': (bexp_workload, {'small': 50, 'medium': 200, 'large': 800}),
+    'for_loop': (for_workload, {'small': 1000, 'medium': 10000, 'large': 100000}),
+    'print_loop': (print_workload, {'small': 1000, 'medium': 10000, 'large': 50000}),
+    'calls': (call_workload, {'small': 1000, 'medium': 5000, 'large': 20000}),
+}
+phases = ('lex', 'parse', 'eval')
+
+
+# Each phase of a run, given the result of the one before it
+def run_phase(phase, value):
+    if phase == 'lex':
+        return CAMlexer.lex(value)
+    if phase == 'parse':
+        result = CAMparser.parse(value)
+        if not result:
+            raise RuntimeError('workload does not parse')
+        return result.value
+    value.eval({"printing": CAMio.NullSink()})
+    return value
+
+
+# Times each phase repeat times, collecting garbage before each, and
+# measures each phase's peak memory in a run of its own
+def measure(source, repeat):
+    times = dict((phase, []) for phase in phases)
+    for _ in range(repeat):
+        value = source
+        for phase in phases:
+            gc.collect()
+            start = time.perf_counter()
+            value = run_phase(phase, value)
+            times[phase].append(time.perf_counter() - start)
+    memory = {}
+    value = source
+    tracemalloc.start()
+    try:
+        for phase in phases:
+            gc.collect()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            value = run_phase(phase, value)
+            memory[phase] = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return {
+        'size': len(source),
+        'time': dict((phase, {'min': min(runs), 'median': statistics.median(runs)})
+                     for phase, runs in times.items()),
+        'peak_bytes': memory,
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Runs the named workloads at the named scales and returns the results
+def run_suite(names=None, scales=('small', 'medium', 'large'), repeat=5, log=None):
+    results = {}
+    for name in names or sorted(workloads):
+        generate, sizes = workloads[name]
+        for scale in scales:
+            key = '%s/%s' % (name, scale)
+            results[key] = measure(generate(sizes[scale]), repeat)
+            if log is not None:
+                timings = results[key]['time']
+                log.write('{:<22} {}\n'.format(key, '  '.join(
+                    '{} {:.4f}s'.format(phase, timings[phase]['min']) for phase in phases)))
+    return {
+        'meta': {
+            'revision': revision(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+# Compares the fastest times and the peak memory of each phase in two suite
+# results and returns the regressions: changes for the worse by more than
+# threshold, as a fraction, and by more than noise seconds for times.
+# Workloads whose source has changed size are skipped.
+def compare(old, new, threshold=0.1, noise=0.001, log=None):
+    regressions = []
+    for key in sorted(set(old['results']) & set(new['results'])):
+        before, after = old['results'][key], new['results'][key]
+        if before['size'] != after['size']:
+            # The generator changed, so the numbers measure different programs
+            if log is not None:
+                log.write('{:<22} workload changed, not compared\n'.format(key))
+            continue
+        for phase in phases:
+            measures = [('time', before['time'][phase]['min'], after['time'][phase]['min'], noise),
+                        ('memory', before['peak_bytes'][phase], after['peak_bytes'][phase], 0)]
+            for kind, was, now, floor in measures:
+                change = (now - was) / was if was else 0.0
+                regressed = change > threshold and now - was > floor
+                improved = change < -threshold and was - now > floor
+                if regressed:
+                    regressions.append((key, phase, kind, was, now, change))
+                if log is not None:
+                    log.write('{:<22} {:<6} {:<7} {:>12.6g} -> {:<12.6g} {:+7.1%}{}\n'.format(
+                        key, phase, kind, was, now, change,
+                        '  REGRESSION' if regressed else '  improved' if improved else ''))
+    return regressions
+
+
+# Runs every benchmark above, each printing its own comparison
+def run_benches():
+    bench_lexer()
+    bench_token_memory()
+    bench_parallel_lexer()
+    bench_packrat()
+    bench_dispatch()
+    bench_engines()
+    bench_backends()
+    bench_optimizer()
+    bench_loops()
+    bench_stepper()
+    bench_async()
+    bench_batch()
+    bench_output()
+    bench_input()
+    bench_cache()
+    bench_embedding()
+    bench_embedding(backend='vm')
+    bench_profile()
+    bench_grammar()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='CAM benchmarks. With no command, runs every benchmark.')
+    commands = parser.add_subparsers(dest='command')
+    suite = commands.add_parser('suite', help='run the benchmark suite and write its results as JSON')
+    suite.add_argument('-o', '--output', default=None, help='results file (default: stdout)')
+    suite.add_argument('--repeat', type=int, default=5, help='runs of each workload to take the fastest of')
+    suite.add_argument('--scales', default='small,medium,large', help='comma-separated scales to run')
+    suite.add_argument('--workloads', default=None, help='comma-separated workloads to run (default: all)')
+    compare_parser = commands.add_parser('compare', help='report regressions between two suite results')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fraction by which a time or peak may grow before it is a regression')
+    compare_parser.add_argument('--noise', type=float, default=0.001,
+                                help='seconds by which a time may grow regardless of the threshold')
+    options = parser.parse_args(arguments)
+
+    if options.command is None:
+        run_benches()
+    elif options.command == 'suite':
+        names = options.workloads.split(',') if options.workloads else None
+        results = run_suite(names, options.scales.split(','), options.repeat, sys.stderr)
+        text = json.dumps(results, indent=2, sort_keys=True)
+        if options.output:
+            with open(options.output, 'w') as output:
+                output.write(text + '\n')
+        else:
+            print(text)
+    else:
+        with open(options.old) as old, open(options.new) as new:
+            regressions = compare(json.load(old), json.load(new), options.threshold, options.noise, sys.stdout)
+        print('{} regression{} beyond {:.0%}'.format(len(regressions), '' if len(regressions) == 1 else 's',
+                                                   options.threshold))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
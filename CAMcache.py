@@ -0,0 +1,75 @@
+import hashlib, os, pickle, sys, tempfile
+
+# Keeps parsed, and optionally optimized, programs on disk as __pycache__
+# keeps bytecode, so running an unchanged script again skips lexing and
+# parsing. A program's tree is pickled into a .camc file in a __camcache__
+# directory next to its source, or in a cache directory shared by many
+# sources. The file name carries the interpreter's cache tag and the
+# optimization level, and the file starts with a header:
+#
+#   magic      b'CAMC' and the cache version
+#   hash       the SHA-256 of the source it was made from
+#
+# A file whose header does not match the source, or that cannot be read, is
+# a miss and is replaced the next time the program is compiled.
+
+# Bumped whenever a change to CAMast, CAMoptimize or CAMloops makes older
+# trees wrong to run
+cache_version = 2
+magic = b'CAMC' + bytes([cache_version])
+directory_name = '__camcache__'
+
+
+def source_hash(data):
+    return hashlib.sha256(data).digest()
+
+
+# Where the tree for the source at path is kept
+def cache_path(path, optimize=0, cache_dir=None):
+    directory, name = os.path.split(os.path.abspath(path))
+    stem = os.path.splitext(name)[0]
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, directory_name)
+    else:
+        # Sources from different directories can share a name
+        stem += '.' + hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, '%s.%s.O%d.camc' % (stem, sys.implementation.cache_tag, optimize))
+
+
+# Returns the tree cached for data, the contents of the source at path, or
+# None if there is none
+def read(path, data, optimize=0, cache_dir=None):
+    try:
+        with open(cache_path(path, optimize, cache_dir), 'rb') as cached:
+            header = cached.read(len(magic) + 32)
+            if header != magic + source_hash(data):
+                return None
+            return pickle.load(cached)
+    except Exception:
+        return None
+
+
+# Saves ast as the tree for data. The file is written under a temporary name
+# and renamed into place, so a reader never sees half of it. Failing to write
+# it, to a read-only directory for instance, is not an error.
+def write(path, data, ast, optimize=0, cache_dir=None):
+    target = cache_path(path, optimize, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    except OSError:
+        return False
+    try:
+        with os.fdopen(descriptor, 'wb') as cached:
+            cached.write(magic + source_hash(data))
+            pickle.dump(ast, cached, pickle.HIGHEST_PROTOCOL)
+        # Readable by whoever can read the source, as mkstemp's files are not
+        os.chmod(temporary, os.stat(path).st_mode & 0o666)
+        os.replace(temporary, target)
+        return True
+    except Exception:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,166 @@
+import array
+import CAMparser
+from CAMlexer import masterExpression, groupTags, RESERVED
+from CAMast import BlockStatement
+
+# Keywords that open a block closed by 'end'. Only a ';' outside every block
+# separates top-level statements.
+openers = {'if', 'while', 'for', 'func'}
+
+
+# One top-level statement: its tokens, their offsets relative to start, and the
+# parsed node, or None if the statement does not parse on its own
+class Segment:
+    def __init__(self, start):
+        self.start = start
+        self.tokens = []
+        self.offsets = array.array('i')
+        self.node = None
+
+    def __repr__(self):
+        return 'Segment(%d, %s)' % (self.start, self.node)
+
+
+# A source text kept as a list of top-level statements. An edit re-lexes from
+# the statement before it and stops as soon as lexing reaches the unchanged
+# start of a later statement, so only the statements it touched are re-lexed
+# and re-parsed.
+#
+# Like a gap buffer, segments before self.split store their start from the
+# beginning of the text and the rest store it from the end. An edit only has
+# to move the split to where it happened, and text after the edit keeps its
+# distance from the end, so nothing after it needs shifting.
+class Document:
+    def __init__(self, text, engine='combinator'):
+        self.text = text
+        self.engine = engine
+        self.segments = []
+        self.split = 0
+        self.relex(0, 0, 0)
+
+    @property
+    def ast(self):
+        if not self.segments or self.errors:
+            return None
+        return BlockStatement([segment.node for segment in self.segments])
+
+    @property
+    def errors(self):
+        return [segment for segment in self.segments if segment.node is None]
+
+    def start(self, index):
+        segment = self.segments[index]
+        if index < self.split:
+            return segment.start
+        return len(self.text) - segment.start
+
+    def move_split(self, index):
+        segments = self.segments
+        end = len(self.text)
+        while self.split < index:
+            segments[self.split].start = end - segments[self.split].start
+            self.split += 1
+        while self.split > index:
+            self.split -= 1
+            segments[self.split].start = end - segments[self.split].start
+
+    # Index of the first segment starting at or after offset
+    def find(self, offset):
+        low, high = 0, len(self.segments)
+        while low < high:
+            middle = (low + high) // 2
+            if self.start(middle) < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Replaces removed characters at offset with inserted and returns the
+    # number of statements that were re-parsed
+    def edit(self, offset, removed, inserted):
+        if offset < 0 or removed < 0 or offset + removed > len(self.text):
+            raise RuntimeError('edit outside the document: {} +{}'.format(offset, removed))
+
+        # Restart at the last statement that begins before the edit, or at the
+        # top if there is none. Statements that begin after the removed text
+        # are unchanged, and lexing can stop when it reaches one of them.
+        first = self.find(offset) - 1
+        following = self.find(offset + removed)
+        self.move_split(following)
+        if first < 0:
+            first, restart = 0, 0
+        else:
+            restart = self.segments[first].start
+        self.text = self.text[:offset] + inserted + self.text[offset + removed:]
+        return self.relex(restart, first, following)
+
+    # Lexes from pos and replaces self.segments[first:following] and any later
+    # segments it runs into by the statements found, stopping at the first
+    # kept segment whose start lexing lands on
+    def relex(self, pos, first, following):
+        match = masterExpression.match
+        text = self.text
+        end = len(text)
+        segments = self.segments
+        kept = following
+        segment = None
+        new = []
+        separated = False
+        depth = 0
+        while pos < end:
+            found = match(text, pos)
+            if not found:
+                # Kept as a token no parser accepts, so only this statement
+                # fails to parse
+                if segment is None:
+                    segment = Segment(pos)
+                    new.append(segment)
+                    separated = False
+                segment.tokens.append((text[pos], None))
+                segment.offsets.append(pos - segment.start)
+                pos += 1
+                continue
+            tag = groupTags[found.lastgroup]
+            if tag:
+                start = found.start()
+                if segment is None:
+                    while kept < len(segments) and end - segments[kept].start < start:
+                        kept += 1
+                    if kept < len(segments) and end - segments[kept].start == start:
+                        separated = False
+                        break
+                    segment = Segment(start)
+                    new.append(segment)
+                    separated = False
+                token = found.group()
+                if tag is RESERVED:
+                    if token == ';' and depth == 0:
+                        segment = None
+                        separated = True
+                        pos = found.end()
+                        continue
+                    if token in openers:
+                        depth += 1
+                    elif token == 'end' and depth:
+                        depth -= 1
+                segment.tokens.append((token, tag))
+                segment.offsets.append(start - segment.start)
+            pos = found.end()
+        else:
+            kept = len(segments)
+        if separated:
+            # A trailing ';' leaves an empty statement, which does not parse
+            new.append(Segment(end))
+
+        for segment in new:
+            self.parse(segment)
+        segments[first:kept] = new
+        self.split = first + len(new)
+        return len(new)
+
+    def parse(self, segment):
+        result = CAMparser.parse(segment.tokens, engine=self.engine) if segment.tokens else None
+        if result and len(result.value.statements) == 1:
+            segment.node = result.value.statements[0]
+        else:
+            segment.node = None
@@ -0,0 +1,196 @@
+import io, re, sys
+
+# Where print statements write, and where input statements read. A program's sink is kept in its environment
+# under "printing", which no CAM variable can be called since it lexes as
+# print followed by ing. Every evaluator writes to the sink it finds there,
+# and to sys.stdout through print() when there is none.
+#
+# A sink takes each printed value with write() and formats it the way
+# print() would; flush() pushes out anything it holds back. A plain list, as
+# in the {"printing": []} environments CAM.main used to make, collects the
+# printed lines as a CaptureSink's lines do.
+#
+# A program's input provider is kept under "input", which is a keyword and so
+# is not a variable name either. A provider's read_value() returns the next
+# value an input statement assigns, or raises EOFError as input() does when
+# there are no more. Without a provider input statements read sys.stdin.
+
+
+# Writes each value as it is printed, as print() does
+class StdoutSink:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, value):
+        (self.stream or sys.stdout).write(str(value) + '\n')
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+
+# Collects printed lines and writes them to stream in one call once they
+# reach flush_size characters
+class BufferedSink:
+    def __init__(self, stream=None, flush_size=1 << 16):
+        self.stream = stream
+        self.flush_size = flush_size
+        self.parts = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.flush()
+
+    def write(self, value):
+        text = str(value) + '\n'
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        if self.parts:
+            stream.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+        stream.flush()
+
+
+# Keeps every printed line in lines, or in the list given, for the embedder
+# to read back
+class CaptureSink:
+    def __init__(self, lines=None):
+        self.lines = [] if lines is None else lines
+
+    def write(self, value):
+        self.lines.append(str(value))
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(line + '\n' for line in self.lines)
+
+
+# Throws printed values away, for benchmarks
+class NullSink:
+    def write(self, value):
+        pass
+
+    def flush(self):
+        pass
+
+
+# The sink in env, or None if print statements write to sys.stdout
+def sink(env):
+    value = env.get("printing")
+    if value.__class__ is list:
+        return CaptureSink(value)
+    return value
+
+
+# The function a print statement in env should call
+def printer(env):
+    output = sink(env)
+    return print if output is None else output.write
+
+
+# Integers as int() reads them, for lines that are not all ASCII digits
+number = re.compile(r'\s*[+-]?\d+(?:_\d+)*\s*')
+
+
+# Converts a line read for an input statement to an int when it is one, and
+# otherwise leaves it as it is
+def parse_value(line):
+    if line.isdigit() and line.isascii():
+        return int(line)
+    if number.fullmatch(line):
+        return int(line)
+    return line
+
+
+# Hands out values from a list or any other iterable. Strings are read as
+# lines would be; anything else is assigned as it is.
+class ValueInput:
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def read_value(self):
+        for value in self.values:
+            if type(value) is bytes:
+                value = value.decode()
+            if type(value) is str:
+                return parse_value(value)
+            return value
+        raise EOFError('EOF when reading a line')
+
+
+# Reads lines from anything with a read(size) method, text or binary: open
+# files, mmaps, sockets' makefile()s. The stream is read chunk_size at a time
+# and split into lines once per chunk.
+class StreamInput:
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lines = []
+        self.position = 0
+        # The unfinished line at the end of the last chunk, None once the
+        # stream has run out
+        self.rest = ''
+
+    def read_value(self):
+        while self.position == len(self.lines):
+            if not self.fill():
+                raise EOFError('EOF when reading a line')
+        line = self.lines[self.position]
+        self.position += 1
+        if type(line) is bytes:
+            line = line.decode()
+        if line.endswith('\r'):
+            line = line[:-1]
+        return parse_value(line)
+
+    def fill(self):
+        if self.rest is None:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.lines = [self.rest] if self.rest else []
+            self.rest = None
+        else:
+            if not self.rest:
+                self.rest = chunk[:0]
+            self.lines = (self.rest + chunk).split(b'\n' if type(chunk) is bytes else '\n')
+            self.rest = self.lines.pop()
+        self.position = 0
+        return True
+
+
+# The provider for source: a provider, a file-like object, the whole input as
+# a str or bytes, or an iterable of values
+def provider(source):
+    if hasattr(source, 'read_value'):
+        return source
+    if type(source) is str:
+        return StreamInput(io.StringIO(source))
+    if type(source) is bytes:
+        return StreamInput(io.BytesIO(source))
+    if hasattr(source, 'read'):
+        return StreamInput(source)
+    return ValueInput(source)
+
+
+# The value for an input statement in env, from its provider or otherwise a
+# line of sys.stdin. Reading stdin writes out whatever the sink holds back
+# first, so a prompt printed before the input is seen before it is answered.
+def read_input(env):
+    source = env.get("input")
+    if source is not None:
+        return source.read_value()
+    output = sink(env)
+    if output is not None:
+        output.flush()
+    return parse_value(input())
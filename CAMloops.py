@@ -0,0 +1,306 @@
+import fractions
+from CAMast import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Runs for loops whose body only accumulates into or recomputes variables
+# from the loop variable without a Python iteration per element: sums of
+# integer polynomials in closed form, and float arithmetic as NumPy arrays
+# when NumPy is installed.
+#
+# A plan gives up and lets the loop run whenever it cannot be certain of
+# the result the loop would give, so the loop raises its own errors after
+# the assignments it would have made first.
+
+# Shorter loops run as they are
+closed_form_threshold = 16
+max_degree = 8
+# Integers up to this size convert to floats exactly
+exact_limit = 1 << 53
+# Rows of loop iterations NumPy evaluates at a time
+chunk_size = 1 << 16
+
+numpy_functions = {}
+if numpy is not None:
+    numpy_functions = {'+': numpy.add, '-': numpy.subtract, '*': numpy.multiply, '/': numpy.true_divide}
+
+
+# s = s + t1 - t2 ...: each iteration adds or subtracts the terms in order
+class Reduction(Equality):
+    def __init__(self, name, terms):
+        self.name = name
+        self.terms = terms
+        self.reads = []
+
+    def __repr__(self):
+        return 'Reduction(%s, [%s])' % (self.name, ', '.join('%s %s' % term for term in self.terms))
+
+    def exps(self):
+        return [term for op, term in self.terms]
+
+
+# v = g(i): only the last iteration's value is kept
+class Elementwise(Equality):
+    def __init__(self, name, exp):
+        self.name = name
+        self.exp = exp
+        self.reads = []
+
+    def __repr__(self):
+        return 'Elementwise(%s, %s)' % (self.name, self.exp)
+
+    def exps(self):
+        return [self.exp]
+
+
+def statements(node):
+    if isinstance(node, BlockStatement):
+        return [statement for child in node.statements for statement in statements(child)]
+    if isinstance(node, CompoundStatement):
+        return statements(node.first) + statements(node.second)
+    return [node]
+
+
+# Splits a left-nested chain of + and - into its head and its (op, term)s
+def chain(exp):
+    terms = []
+    while isinstance(exp, BinopAexp) and exp.op in ('+', '-'):
+        terms.append((exp.op, exp.right))
+        exp = exp.left
+    terms.reverse()
+    return exp, terms
+
+
+# The variables an arithmetic expression reads, or None if it is not made of
+# integers, variables and arithmetic alone
+def arithmetic_reads(node):
+    if isinstance(node, IntAexp):
+        return set()
+    if isinstance(node, VarExp):
+        return {node.name}
+    if isinstance(node, BinopAexp):
+        left, right = arithmetic_reads(node.left), arithmetic_reads(node.right)
+        if left is None or right is None:
+            return None
+        return left | right
+    return None
+
+
+# Returns a LoopPlan for a for loop whose body is a list of assignments that
+# do not read each other's variables, or None
+def analyse(loop):
+    body = statements(loop.body)
+    assigned = set()
+    for statement in body:
+        if not isinstance(statement, AssignStatement) or statement.name == loop.name \
+                or statement.name in assigned:
+            return None
+        assigned.add(statement.name)
+
+    steps = []
+    reads = set()
+    for statement in body:
+        head, terms = chain(statement.exp)
+        if terms and isinstance(head, VarExp) and head.name == statement.name:
+            step = Reduction(statement.name, terms)
+            reads.add(statement.name)
+        else:
+            step = Elementwise(statement.name, statement.exp)
+        step_reads = set()
+        for exp in step.exps():
+            names = arithmetic_reads(exp)
+            if names is None or names & assigned:
+                return None
+            step_reads |= names
+        step_reads.discard(loop.name)
+        step.reads = sorted(step_reads)
+        reads |= step_reads
+        steps.append(step)
+    return LoopPlan(loop, steps, sorted(reads))
+
+
+# Degree of an expression as a polynomial in name, or None if it divides
+def degree(node, name):
+    if isinstance(node, IntAexp):
+        return 0
+    if isinstance(node, VarExp):
+        return 1 if node.name == name else 0
+    if node.op == '/':
+        return None
+    left, right = degree(node.left, name), degree(node.right, name)
+    if left is None or right is None:
+        return None
+    if node.op == '*':
+        return left + right
+    return max(left, right)
+
+
+# (float, bound): whether node gives a float, and otherwise the largest
+# absolute value it takes, or None if an integer in it could pass
+# exact_limit or a variable is not a number
+def value_bound(node, name, index_bound, values):
+    if isinstance(node, IntAexp):
+        return False, abs(node.i)
+    if isinstance(node, VarExp):
+        if node.name == name:
+            return False, index_bound
+        value = values[node.name]
+        if type(value) is float:
+            return True, 0
+        if type(value) is not int:
+            return None
+        return False, abs(value)
+    left = value_bound(node.left, name, index_bound, values)
+    right = value_bound(node.right, name, index_bound, values)
+    if left is None or right is None:
+        return None
+    if node.op == '/' or left[0] or right[0]:
+        return True, 0
+    bound = left[1] * right[1] if node.op == '*' else left[1] + right[1]
+    if bound >= exact_limit:
+        return None
+    return False, bound
+
+
+# Lagrange interpolation through (0, ys[0]), (1, ys[1]), ... evaluated at x
+def interpolate(ys, x):
+    total = fractions.Fraction(0)
+    for j, y in enumerate(ys):
+        term = fractions.Fraction(y)
+        for m in range(len(ys)):
+            if m != j:
+                term *= fractions.Fraction(x - m, j - m)
+        total += term
+    return int(total)
+
+
+# Evaluates node for every value of name in index, a NumPy array
+def vector(node, name, index, values):
+    if isinstance(node, IntAexp):
+        return node.i
+    if isinstance(node, VarExp):
+        return index if node.name == name else values[node.name]
+    function = numpy_functions[node.op]
+    return function(vector(node.left, name, index, values), vector(node.right, name, index, values))
+
+
+def float_column(node, name, index, values):
+    column = numpy.asarray(vector(node, name, index, values), dtype=numpy.float64)
+    return numpy.broadcast_to(column, index.shape)
+
+
+class LoopPlan(Equality):
+    def __init__(self, loop, steps, reads):
+        self.loop = loop
+        self.steps = steps
+        self.reads = reads
+
+    def __repr__(self):
+        return 'LoopPlan(%s, [%s])' % (self.loop.name, ', '.join(repr(step) for step in self.steps))
+
+    # Runs the loop against env and returns True, or returns False without
+    # changing env if the loop has to run as it is
+    def run(self, env):
+        loop = self.loop
+        start = loop.start.eval(env)
+        end = loop.end.eval(env)
+        if type(start) is not int or type(end) is not int or end - start < closed_form_threshold:
+            return False
+        values = {}
+        for name in self.reads:
+            if name not in env:
+                return False
+            values[name] = env[name]
+        results = []
+        try:
+            for step in self.steps:
+                if isinstance(step, Reduction):
+                    result = self.reduce(step, start, end, values)
+                else:
+                    result = self.last(step, start, end, values)
+                if result is None:
+                    return False
+                results.append((step.name, result))
+        except Exception:
+            return False
+        env[loop.name] = end - 1
+        for name, value in results:
+            env[name] = value
+        return True
+
+    def point(self, values, index):
+        point = dict(values)
+        point[self.loop.name] = index
+        return point
+
+    def reduce(self, step, start, end, values):
+        name = self.loop.name
+        initial = values[step.name]
+        if type(initial) is int and all(type(values[read]) is int for read in step.reads):
+            degrees = [degree(term, name) for term in step.exps()]
+            if None not in degrees and max(degrees) <= max_degree:
+                return initial + self.polynomial_sum(step, start, end, values, max(degrees))
+        return self.numpy_reduce(step, start, end, values)
+
+    # Sums the terms over the loop by sampling the running total, a
+    # polynomial one degree higher than the terms, and interpolating it
+    def polynomial_sum(self, step, start, end, values, degree):
+        sums = [0]
+        for index in range(start, start + degree + 1):
+            point = self.point(values, index)
+            total = sums[-1]
+            for op, term in step.terms:
+                total = total + term.eval(point) if op == '+' else total - term.eval(point)
+            sums.append(total)
+        return interpolate(sums, end - start)
+
+    # Adds the terms in the order the loop would, one float at a time, so the
+    # result rounds exactly as it does in the loop
+    def numpy_reduce(self, step, start, end, values):
+        initial = values[step.name]
+        if numpy is None or type(initial) not in (int, float):
+            return None
+        name = self.loop.name
+        index_bound = max(abs(start), abs(end - 1))
+        bounds = [value_bound(term, name, index_bound, values) for term in step.exps()]
+        if None in bounds:
+            return None
+        # The loop's total is an int unless something in it is a float
+        if type(initial) is int and not any(is_float for is_float, bound in bounds):
+            return None
+        if type(initial) is int and abs(initial) + sum(bound for is_float, bound in bounds) >= exact_limit:
+            return None
+        total = numpy.float64(initial)
+        with numpy.errstate(all='raise'):
+            for chunk_start in range(start, end, chunk_size):
+                index = numpy.arange(chunk_start, min(chunk_start + chunk_size, end), dtype=numpy.int64)
+                columns = numpy.empty((len(index), len(step.terms)))
+                for column, (op, term) in enumerate(step.terms):
+                    values_column = float_column(term, name, index, values)
+                    columns[:, column] = values_column if op == '+' else -values_column
+                running = numpy.add.accumulate(numpy.concatenate(([total], columns.ravel())))
+                total = running[-1]
+        return float(total)
+
+    # The value of an elementwise assignment after the last iteration, once
+    # it is certain that no earlier iteration raises
+    def last(self, step, start, end, values):
+        name = self.loop.name
+        index_bound = max(abs(start), abs(end - 1))
+        if all(type(values[read]) is int for read in step.reads) and degree(step.exp, name) is not None:
+            return step.exp.eval(self.point(values, end - 1))
+        bound = value_bound(step.exp, name, index_bound, values)
+        if bound is None:
+            return None
+        if degree(step.exp, name) is None:
+            # Division could fail for some value of the loop variable
+            if numpy is None:
+                return None
+            with numpy.errstate(all='raise'):
+                for chunk_start in range(start, end, chunk_size):
+                    index = numpy.arange(chunk_start, min(chunk_start + chunk_size, end), dtype=numpy.int64)
+                    float_column(step.exp, name, index, values)
+        return step.exp.eval(self.point(values, end - 1))
@@ -0,0 +1,378 @@
+import time
+import CAMloops
+from CAMast import *
+
+# Optimization passes over CAMast trees. A pass returns a new tree and leaves
+# the one it was given alone, and counts the rewrites it made in changes.
+#
+# Every pass keeps what the tree walker would do, including which errors a
+# program raises: a rewrite that could turn an error into a value, or a
+# value into an error, is not made.
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for child in children(node))
+
+
+def children(node):
+    if isinstance(node, BlockStatement):
+        return node.statements
+    if isinstance(node, CompoundStatement):
+        return [node.first, node.second]
+    if isinstance(node, (AssignStatement, PrintStatement)):
+        return [node.exp]
+    if isinstance(node, IfStatement):
+        return [node.condition, node.true_stmt] + ([node.false_stmt] if node.false_stmt else [])
+    if isinstance(node, WhileStatement):
+        return [node.condition, node.body]
+    if isinstance(node, ForStatement):
+        return [node.start, node.end, node.body]
+    if isinstance(node, FunctionStatement):
+        return [node.body]
+    if isinstance(node, (HoistedLoop, ReducedLoop)):
+        return [node.loop]
+    if isinstance(node, (BinopAexp, RelopBexp, AndBexp, OrBexp)):
+        return [node.left, node.right]
+    if isinstance(node, (NotBexp, InvariantExp)):
+        return [node.exp]
+    return []
+
+
+# Base class for passes. statement and exp return the node with its children
+# rewritten; passes override them to rewrite the node itself afterwards.
+# Invariants and reduced loops are kept as they are, since what they cache
+# or plan depends on the nodes inside them. Rebuilt statements keep the
+# source position of the ones they replace.
+class Pass:
+    name = 'pass'
+
+    def __init__(self):
+        self.changes = 0
+
+    def run(self, ast):
+        return self.statement(ast)
+
+    def statement(self, node):
+        return self.rebuild_statement(node)
+
+    def exp(self, node):
+        return self.rebuild_exp(node)
+
+    def rebuild_statement(self, node):
+        return locate(self.copy_statement(node), node)
+
+    def copy_statement(self, node):
+        if isinstance(node, BlockStatement):
+            statements = []
+            for statement in node.statements:
+                statement = self.statement(statement)
+                # Branches a pass has inlined join the enclosing list
+                if isinstance(statement, BlockStatement):
+                    statements.extend(statement.statements)
+                else:
+                    statements.append(statement)
+            return BlockStatement(statements)
+        if isinstance(node, CompoundStatement):
+            return CompoundStatement(self.statement(node.first), self.statement(node.second))
+        if isinstance(node, AssignStatement):
+            return AssignStatement(node.name, self.exp(node.exp))
+        if isinstance(node, PrintStatement):
+            return PrintStatement(self.exp(node.exp))
+        if isinstance(node, IfStatement):
+            return IfStatement(self.exp(node.condition), self.statement(node.true_stmt),
+                               self.statement(node.false_stmt) if node.false_stmt else None)
+        if isinstance(node, WhileStatement):
+            return WhileStatement(self.exp(node.condition), self.statement(node.body))
+        if isinstance(node, ForStatement):
+            return ForStatement(node.name, self.exp(node.start), self.exp(node.end), self.statement(node.body))
+        if isinstance(node, FunctionStatement):
+            return FunctionStatement(node.name, self.statement(node.body))
+        if isinstance(node, HoistedLoop):
+            return HoistedLoop(self.statement(node.loop), node.invariants)
+        return node
+
+    def rebuild_exp(self, node):
+        if isinstance(node, BinopAexp):
+            return BinopAexp(node.op, self.exp(node.left), self.exp(node.right))
+        if isinstance(node, RelopBexp):
+            return RelopBexp(node.op, self.exp(node.left), self.exp(node.right))
+        if isinstance(node, AndBexp):
+            return AndBexp(self.exp(node.left), self.exp(node.right))
+        if isinstance(node, OrBexp):
+            return OrBexp(self.exp(node.left), self.exp(node.right))
+        if isinstance(node, NotBexp):
+            return NotBexp(self.exp(node.exp))
+        return node
+
+
+# Removes the wrappers that loop-invariant code motion and loop reduction
+# leave, giving back the plain tree
+class Unwrap(Pass):
+    def statement(self, node):
+        if isinstance(node, (HoistedLoop, ReducedLoop)):
+            return self.statement(node.loop)
+        return self.rebuild_statement(node)
+
+    def exp(self, node):
+        if isinstance(node, InvariantExp):
+            return self.exp(node.exp)
+        return self.rebuild_exp(node)
+
+
+# Evaluates an expression that reads no variables and cannot divide, and
+# returns (True, value), or (False, None) if it is not such an expression or
+# evaluating it raises
+def constant_value(node):
+    if isinstance(node, (IntAexp, StringExp)):
+        return True, node.eval({})
+    if isinstance(node, (BinopAexp, RelopBexp, AndBexp, OrBexp)):
+        if isinstance(node, BinopAexp) and node.op == '/':
+            return False, None
+        left, right = constant_value(node.left), constant_value(node.right)
+        if not (left[0] and right[0]):
+            return False, None
+    elif isinstance(node, NotBexp):
+        if not constant_value(node.exp)[0]:
+            return False, None
+    else:
+        return False, None
+    try:
+        return True, node.eval({})
+    except Exception:
+        return False, None
+
+
+# Replaces arithmetic on two integer literals, and + on two string literals,
+# by its result. Division is left alone: it gives a float, which IntAexp
+# cannot hold, and may raise.
+class ConstantFolding(Pass):
+    name = 'constant folding'
+
+    def exp(self, node):
+        node = self.rebuild_exp(node)
+        if isinstance(node, BinopAexp):
+            left, right = node.left, node.right
+            if isinstance(left, IntAexp) and isinstance(right, IntAexp) and node.op in ('+', '-', '*'):
+                self.changes += 1
+                return IntAexp(node.eval({}))
+            if isinstance(left, StringExp) and isinstance(right, StringExp) and node.op == '+':
+                self.changes += 1
+                return StringExp('"%s"' % node.eval({}))
+        return node
+
+
+# Removes if statements, while loops and for loops whose outcome is known
+# before they run: an if keeps the branch its constant condition picks, and
+# a loop that cannot run once is dropped
+class DeadCodeElimination(Pass):
+    name = 'dead code elimination'
+
+    def statement(self, node):
+        node = self.rebuild_statement(node)
+        if isinstance(node, IfStatement):
+            constant, value = constant_value(node.condition)
+            if constant:
+                self.changes += 1
+                if value:
+                    return node.true_stmt
+                return node.false_stmt or BlockStatement([])
+        elif isinstance(node, WhileStatement):
+            constant, value = constant_value(node.condition)
+            if constant and not value:
+                self.changes += 1
+                return BlockStatement([])
+        elif isinstance(node, ForStatement):
+            start, end = constant_value(node.start), constant_value(node.end)
+            if start[0] and end[0] and isinstance(start[1], int) and isinstance(end[1], int) \
+                    and start[1] >= end[1]:
+                self.changes += 1
+                return BlockStatement([])
+        return node
+
+
+# True for expressions whose value, when they have one, is always a number:
+# - and / never give a string, and + or * only give one from a string operand
+def numeric(node):
+    if isinstance(node, IntAexp):
+        return True
+    if isinstance(node, BinopAexp):
+        return node.op in ('-', '/') or numeric(node.left) and numeric(node.right)
+    return False
+
+
+# Rewrites arithmetic into cheaper forms. x * 2 becomes x + x for a variable
+# x, which is the same for numbers and strings, and multiplying by one or
+# subtracting zero disappears when the other side is known to be a number.
+# Adding zero stays, since -0.0 + 0 is 0.0.
+class StrengthReduction(Pass):
+    name = 'strength reduction'
+
+    def exp(self, node):
+        node = self.rebuild_exp(node)
+        if not isinstance(node, BinopAexp):
+            return node
+        left, right = node.left, node.right
+        for this, other in ((left, right), (right, left)):
+            if not isinstance(other, IntAexp):
+                continue
+            if node.op == '*' and other.i == 2 and isinstance(this, VarExp):
+                self.changes += 1
+                return BinopAexp('+', this, VarExp(this.name))
+            if node.op == '*' and other.i == 1 and numeric(this):
+                self.changes += 1
+                return this
+        if node.op == '-' and isinstance(right, IntAexp) and right.i == 0 and numeric(left):
+            self.changes += 1
+            return left
+        return node
+
+
+# Names a statement assigns, and whether it calls a function, which could
+# assign anything
+def effects(node):
+    if isinstance(node, (AssignStatement, InputStatement)):
+        return {node.name}, False
+    if isinstance(node, FunctionStatement):
+        # Its body only runs when called
+        return {node.name}, False
+    if isinstance(node, FunctionCall):
+        return set(), True
+    names, calls = set(), False
+    if isinstance(node, ForStatement):
+        names.add(node.name)
+    for child in children(node):
+        if isinstance(child, Statement):
+            child_names, child_calls = effects(child)
+            names |= child_names
+            calls = calls or child_calls
+    return names, calls
+
+
+def reads_only(node, names):
+    if isinstance(node, VarExp):
+        return node.name not in names
+    return all(reads_only(child, names) for child in children(node))
+
+
+# Wraps the largest expressions in each while and for loop that read no
+# variable the loop assigns in an InvariantExp, so they are evaluated once
+# per run of the loop. Loops that call a function are left alone.
+class LoopInvariantCodeMotion(Pass):
+    name = 'loop-invariant code motion'
+
+    def run(self, ast):
+        # Invariants from an earlier run would never be reset, so start from
+        # a tree without them
+        return self.statement(Unwrap().run(ast))
+
+    def statement(self, node):
+        if not isinstance(node, (WhileStatement, ForStatement)):
+            return self.rebuild_statement(node)
+        # Outer loops first, so an expression invariant in several nested
+        # loops is reused across all of them
+        names, calls = effects(node.body)
+        if isinstance(node, ForStatement):
+            names.add(node.name)
+        if calls:
+            return self.rebuild_statement(node)
+        invariants = []
+        hoist = Hoister(names, invariants)
+        if isinstance(node, WhileStatement):
+            loop = WhileStatement(hoist.exp(node.condition), hoist.statement(node.body))
+        else:
+            loop = ForStatement(node.name, node.start, node.end, hoist.statement(node.body))
+        locate(loop, node)
+        loop.body = self.statement(loop.body)
+        if not invariants:
+            return loop
+        self.changes += len(invariants)
+        return locate(HoistedLoop(loop, invariants), loop)
+
+
+class Hoister(Pass):
+    def __init__(self, names, invariants):
+        Pass.__init__(self)
+        self.names = names
+        self.invariants = invariants
+
+    def statement(self, node):
+        # A function body does not run as part of the loop
+        if isinstance(node, FunctionStatement):
+            return node
+        return self.rebuild_statement(node)
+
+    def exp(self, node):
+        if isinstance(node, InvariantExp):
+            return node
+        if children(node) and reads_only(node, self.names):
+            invariant = InvariantExp(node)
+            self.invariants.append(invariant)
+            return invariant
+        return self.rebuild_exp(node)
+
+
+# Gives for loops that CAMloops can run without iterating a plan to do so.
+# The plan is made from the loop without invariants, and the loop itself
+# stays in place for when the plan gives up.
+class LoopReduction(Pass):
+    name = 'loop reduction'
+
+    def statement(self, node):
+        node = self.rebuild_statement(node)
+        if isinstance(node, ForStatement):
+            plan = CAMloops.analyse(Unwrap().run(node))
+            if plan:
+                self.changes += 1
+                return locate(ReducedLoop(node, plan), node)
+        return node
+
+
+levels = {
+    0: [],
+    1: [ConstantFolding, DeadCodeElimination],
+    2: [ConstantFolding, StrengthReduction, DeadCodeElimination, LoopInvariantCodeMotion, LoopReduction],
+}
+
+
+class PassStatistics:
+    def __init__(self, name, changes, nodes_before, nodes_after, seconds):
+        self.name = name
+        self.changes = changes
+        self.nodes_before = nodes_before
+        self.nodes_after = nodes_after
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '{:<28} {:>6} changes {:>7} -> {:<7} nodes {:>8.2f}ms'.format(
+            self.name, self.changes, self.nodes_before, self.nodes_after, self.seconds * 1000)
+
+
+# Runs a list of passes, the ones for an optimization level by default, and
+# keeps statistics for each
+class Optimizer:
+    def __init__(self, level=1, passes=None):
+        if passes is None:
+            if level not in levels:
+                raise RuntimeError('unknown optimization level: {}'.format(level))
+            passes = levels[level]
+        self.passes = passes
+        self.statistics = []
+
+    def run(self, ast):
+        nodes = count_nodes(ast)
+        for factory in self.passes:
+            optimization = factory()
+            start = time.perf_counter()
+            ast = optimization.run(ast)
+            seconds = time.perf_counter() - start
+            after = count_nodes(ast)
+            self.statistics.append(PassStatistics(optimization.name, optimization.changes, nodes, after, seconds))
+            nodes = after
+        return ast
+
+    def report(self):
+        return '\n'.join(repr(statistics) for statistics in self.statistics)
+
+
+def optimize(ast, level=1):
+    return Optimizer(level).run(ast)
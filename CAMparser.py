@@ -1,4 +1,4 @@
-import functools
+import functools, sys
 from CAMlexer import *
 from combinators import *
 from CAMast import *
@@ -13,9 +13,34 @@ identifier = Tag(ID)
 string = String(STRING)
 
 
-# Top level parser
-def parse(tokens):
-    ast = parser()(tokens, 0)
+# Wraps a grammar function so the parser it builds is a named Rule, built on
+# the first call and shared by every later one
+def rule(function):
+    @functools.lru_cache(maxsize=None)
+    @functools.wraps(function)
+    def build():
+        return Rule(function(), function.__name__)
+    return build
+
+
+# Top level parser. Pass a Packrat instead of tokens to read its hit and miss
+# counts afterwards. engine='pratt' parses with the hand-written parser in
+# CAMpratt instead, which builds the same tree. instrument=True records what
+# each grammar rule did and prints a report to stderr once the parse is done;
+# pass an Instrumented instead of tokens to read its stats afterwards.
+def parse(tokens, packrat=False, engine='combinator', instrument=False):
+    if engine == 'pratt':
+        import CAMpratt
+        return CAMpratt.parse(tokens)
+    elif engine != 'combinator':
+        raise RuntimeError('unknown parser engine: ' + engine)
+    if instrument and not isinstance(tokens, Instrumented):
+        tokens = Instrumented(tokens, packrat)
+    elif packrat and not isinstance(tokens, (Packrat, Instrumented)):
+        tokens = Packrat(tokens)
+    ast = grammar(tokens, 0)
+    if instrument:
+        print(tokens.report(), file=sys.stderr)
     return ast
 
 
@@ -24,15 +49,18 @@ def parser():
 
 
 # Statements
+@rule
 def stmt_list():
-    separator = keyword(';') ^ (lambda x: lambda l, r: CompoundStatement(l, r))
-    return Exp(stmt(), separator)
+    return stmt() + Rep(keyword(';') + stmt()) ^ process_block
 
 
+@rule
 def stmt():
-    return assign_stmt() | for_stmt() | if_stmt() | while_stmt() | print_stmt() | input_stmt() | func_call() | func_stmt()
+    return Located(Dispatch(assign_stmt(), for_stmt(), if_stmt(), while_stmt(), print_stmt(), input_stmt(),
+                            func_call(), func_stmt()))
 
 
+@rule
 def assign_stmt():
     def process(parsed):
         ((name, _), stm) = parsed
@@ -41,6 +69,7 @@ def assign_stmt():
     return identifier + keyword('=') + exp() ^ process
 
 
+@rule
 def input_stmt():
     def process(parsed):
         (_, name) = parsed
@@ -49,6 +78,7 @@ def input_stmt():
     return keyword('input') + identifier ^ process
 
 
+@rule
 def if_stmt():
     def process(parsed):
         (((((_, condition), _), true_stmt), false_parsed), _) = parsed
@@ -61,6 +91,7 @@ def if_stmt():
     return keyword('if') + bexp() + keyword('then') + Lazy(stmt_list) + Opt(keyword('else') + Lazy(stmt_list)) + keyword('end') ^ process
 
 
+@rule
 def while_stmt():
     def process(parsed):
         ((((_, condition), _), body), _) = parsed
@@ -69,6 +100,7 @@ def while_stmt():
     return keyword('while') + bexp() + keyword('do') + Lazy(stmt_list) + keyword('end') ^ process
 
 
+@rule
 def for_stmt():
     def process(parsed):
         ((((((((_, name), _), start), _), end), _), body), _) = parsed
@@ -77,6 +109,7 @@ def for_stmt():
     return keyword('for') + identifier + keyword('=') + aexp() + keyword('to') + aexp() + keyword('do') + Lazy(stmt_list) + keyword('end') ^ process
 
 
+@rule
 def func_stmt():
     def process(parsed):
         ((((_, name), _), body), _) = parsed
@@ -85,6 +118,7 @@ def func_stmt():
     return keyword('func') + identifier + keyword('do') + Lazy(stmt_list) + keyword('end') ^ process
 
 
+@rule
 def func_call():
     def process(parsed):
         (_, name) = parsed
@@ -93,6 +127,7 @@ def func_call():
     return keyword('call') + identifier ^ process
 
 
+@rule
 def print_stmt():
     def process(parsed):
         (_, value) = parsed
@@ -102,67 +137,80 @@ def print_stmt():
 
 
 # Boolean expressions
+@rule
 def bexp():
     return precedence(bexp_term(),
                       bexp_precedence_levels,
                       process_logic)
 
 
+@rule
 def bexp_term():
-    return bexp_not() | \
-           bexp_relop() | \
-           bexp_group()
+    return Dispatch(bexp_not(),
+                    bexp_relop(),
+                    bexp_group())
 
 
+@rule
 def bexp_not():
     return keyword('not') + Lazy(bexp_term) ^ (lambda parsed: NotBexp(parsed[1]))
 
 
+@rule
 def bexp_relop():
     relops = ['<', '<=', '>', '>=', '==', '!=']
     return exp() + any_operator_in_list(relops) + exp() ^ process_relop
 
 
+@rule
 def exp():
-    return sexp() | aexp()
+    return Dispatch(sexp(), aexp())
 
 
+@rule
 def bexp_group():
     return keyword('(') + Lazy(bexp) + keyword(')') ^ process_group
 
 
+@rule
 def sexp():
     return precedence(sexp_term(),
                       aexp_precedence_levels,
                       process_binop)
 
 
+@rule
 def sexp_term():
     return sexp_value()
 
 
+@rule
 def sexp_value():
     return string ^ (lambda strs: StringExp(strs))
 
 
 # Arithmetic expressions
+@rule
 def aexp():
     return precedence(aexp_term(),
                       aexp_precedence_levels,
                       process_binop)
 
 
+@rule
 def aexp_term():
-    return aexp_value() | aexp_group()
+    return Dispatch(aexp_value(), aexp_group())
 
 
+@rule
 def aexp_group():
     return keyword('(') + Lazy(aexp) + keyword(')') ^ process_group
 
 
+@rule
 def aexp_value():
-    return (num ^ (lambda i: IntAexp(i))) | \
-           (identifier ^ (lambda v: VarExp(v)))
+    return Dispatch(num ^ (lambda i: IntAexp(i)),
+                    identifier ^ (lambda v: VarExp(v)))
 
 
 # An IMP-specific combinator for binary operator expressions (aexp and bexp)
@@ -195,15 +243,19 @@ def process_logic(op):
         raise RuntimeError('unknown logic operator: ' + op)
 
 
+def process_block(parsed):
+    (first, rest) = parsed
+    return BlockStatement([first] + [statement for (_, statement) in rest])
+
+
 def process_group(parsed):
-    print(parsed)
     ((_, p), _) = parsed
     return p
 
 
 def any_operator_in_list(ops):
     op_parsers = [keyword(op) for op in ops]
-    parser = functools.reduce(lambda l, r: l | r, op_parsers)
+    parser = Dispatch(*op_parsers)
     return parser
 
 
@@ -217,3 +269,8 @@ bexp_precedence_levels = [
     ['and'],
     ['or'],
 ]
+
+
+# The grammar is built once at import. Parsers keep no state between calls,
+# so it is shared by every parse, across threads too.
+grammar = parser()
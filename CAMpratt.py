@@ -0,0 +1,294 @@
+from CAMlexer import *
+from CAMast import *
+from combinators import Result, position
+from CAMparser import aexp_precedence_levels, bexp_precedence_levels, process_binop, process_relop, process_logic
+
+
+# A hand-written parser that builds the same CAMast nodes as the combinator
+# grammar in CAMparser: recursive descent for statements and a Pratt loop for
+# binary operators. Every method returns None and leaves pos where it was when
+# it fails, like a combinator.
+def binding_powers(precedence_levels):
+    powers = {}
+    for level, ops in enumerate(precedence_levels):
+        for op in ops:
+            powers[op] = len(precedence_levels) - level
+    return powers
+
+
+aexp_binding_powers = binding_powers(aexp_precedence_levels)
+bexp_binding_powers = binding_powers(bexp_precedence_levels)
+relops = ['<', '<=', '>', '>=', '==', '!=']
+
+
+def parse(tokens):
+    parser = DescentParser(tokens)
+    ast = parser.stmt_list()
+    if ast is None or not parser.at_end():
+        return None
+    return Result(ast, parser.pos)
+
+
+class DescentParser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        try:
+            return self.tokens[self.pos]
+        except IndexError:
+            return None
+
+    def at_end(self):
+        return self.peek() is None
+
+    def keyword(self, kw):
+        token = self.peek()
+        if token is not None and token[0] == kw and token[1] is RESERVED:
+            self.pos += 1
+            return True
+        return False
+
+    def tagged(self, tag):
+        token = self.peek()
+        if token is not None and token[1] is tag:
+            self.pos += 1
+            return token[0]
+        return None
+
+    def operator(self, powers):
+        token = self.peek()
+        if token is not None and token[1] is RESERVED:
+            return powers.get(token[0])
+        return None
+
+    # Statements
+    def stmt_list(self):
+        statement = self.stmt()
+        if statement is None:
+            return None
+        statements = [statement]
+        while True:
+            start = self.pos
+            if not self.keyword(';'):
+                break
+            statement = self.stmt()
+            if statement is None:
+                self.pos = start
+                break
+            statements.append(statement)
+        return BlockStatement(statements)
+
+    # A statement, with the position of its first token when the tokens know it
+    def stmt(self):
+        start = self.pos
+        statement = self.bare_stmt()
+        if statement is not None:
+            where = position(self.tokens, start)
+            if where is not None:
+                statement.line, statement.column = where
+        return statement
+
+    def bare_stmt(self):
+        token = self.peek()
+        if token is None:
+            return None
+        if token[1] is ID:
+            return self.assign_stmt()
+        if token[1] is not RESERVED:
+            return None
+        statement = self.statements.get(token[0])
+        if statement is None:
+            return None
+        start = self.pos
+        self.pos += 1
+        result = statement(self)
+        if result is None:
+            self.pos = start
+        return result
+
+    def assign_stmt(self):
+        start = self.pos
+        name = self.tagged(ID)
+        if self.keyword('='):
+            value = self.exp()
+            if value is not None:
+                return AssignStatement(name, value)
+        self.pos = start
+        return None
+
+    def for_stmt(self):
+        name = self.tagged(ID)
+        if name is None or not self.keyword('='):
+            return None
+        start = self.aexp()
+        if start is None or not self.keyword('to'):
+            return None
+        end = self.aexp()
+        if end is None:
+            return None
+        body = self.block('do')
+        if body is None:
+            return None
+        return ForStatement(name, start, end, body)
+
+    def if_stmt(self):
+        condition = self.bexp()
+        if condition is None or not self.keyword('then'):
+            return None
+        true_stmt = self.stmt_list()
+        if true_stmt is None:
+            return None
+        false_stmt = None
+        start = self.pos
+        if self.keyword('else'):
+            false_stmt = self.stmt_list()
+            if false_stmt is None:
+                self.pos = start
+        if not self.keyword('end'):
+            return None
+        return IfStatement(condition, true_stmt, false_stmt)
+
+    def while_stmt(self):
+        condition = self.bexp()
+        if condition is None:
+            return None
+        body = self.block('do')
+        if body is None:
+            return None
+        return WhileStatement(condition, body)
+
+    def print_stmt(self):
+        value = self.exp()
+        if value is None:
+            return None
+        return PrintStatement(value)
+
+    def input_stmt(self):
+        name = self.tagged(ID)
+        if name is None:
+            return None
+        return InputStatement(name)
+
+    def func_call(self):
+        name = self.tagged(ID)
+        if name is None:
+            return None
+        return FunctionCall(name)
+
+    def func_stmt(self):
+        name = self.tagged(ID)
+        if name is None:
+            return None
+        body = self.block('do')
+        if body is None:
+            return None
+        return FunctionStatement(name, body)
+
+    # Parses opener stmt_list 'end' and returns the statement list
+    def block(self, opener):
+        if not self.keyword(opener):
+            return None
+        body = self.stmt_list()
+        if body is None or not self.keyword('end'):
+            return None
+        return body
+
+    statements = {
+        'for': for_stmt,
+        'if': if_stmt,
+        'while': while_stmt,
+        'print': print_stmt,
+        'input': input_stmt,
+        'call': func_call,
+        'func': func_stmt,
+    }
+
+    # Pratt loop over the binary operators in powers. An operator whose right
+    # operand does not parse is left unconsumed, as Exp does.
+    def binary(self, operand, powers, combine, min_power=1):
+        left = operand()
+        if left is None:
+            return None
+        while True:
+            power = self.operator(powers)
+            if power is None or power < min_power:
+                return left
+            start = self.pos
+            op = self.tokens[start][0]
+            self.pos += 1
+            right = self.binary(operand, powers, combine, power + 1)
+            if right is None:
+                self.pos = start
+                return left
+            left = combine(op)(left, right)
+
+    # Boolean expressions
+    def bexp(self):
+        return self.binary(self.bexp_term, bexp_binding_powers, process_logic)
+
+    def bexp_term(self):
+        start = self.pos
+        if self.keyword('not'):
+            term = self.bexp_term()
+            if term is not None:
+                return NotBexp(term)
+            self.pos = start
+            return None
+        relop = self.bexp_relop()
+        if relop is not None:
+            return relop
+        if self.keyword('('):
+            condition = self.bexp()
+            if condition is not None and self.keyword(')'):
+                return condition
+            self.pos = start
+        return None
+
+    def bexp_relop(self):
+        start = self.pos
+        left = self.exp()
+        if left is not None:
+            token = self.peek()
+            if token is not None and token[1] is RESERVED and token[0] in relops:
+                self.pos += 1
+                right = self.exp()
+                if right is not None:
+                    return process_relop(((left, token[0]), right))
+        self.pos = start
+        return None
+
+    # Arithmetic and string expressions
+    def exp(self):
+        token = self.peek()
+        if token is not None and token[1] is STRING:
+            return self.binary(self.sexp_value, aexp_binding_powers, process_binop)
+        return self.aexp()
+
+    def sexp_value(self):
+        value = self.tagged(STRING)
+        if value is None:
+            return None
+        return StringExp(value)
+
+    def aexp(self):
+        return self.binary(self.aexp_term, aexp_binding_powers, process_binop)
+
+    def aexp_term(self):
+        token = self.peek()
+        if token is None:
+            return None
+        if token[1] is INT:
+            self.pos += 1
+            return IntAexp(int(token[0]))
+        if token[1] is ID:
+            self.pos += 1
+            return VarExp(token[0])
+        start = self.pos
+        if self.keyword('('):
+            value = self.aexp()
+            if value is not None and self.keyword(')'):
+                return value
+            self.pos = start
+        return None
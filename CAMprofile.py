@@ -0,0 +1,192 @@
+import time
+from CAMast import *
+from CAMstepper import Machine, Suspend, finished
+
+# A profiler for CAM programs. ProfilingMachine runs a program on the stepper
+# as Machine does, and also counts how many times each statement runs, how
+# long it takes, and how long each func takes per call. Machine and the
+# other evaluators have no profiling code in them, so a program that is not
+# profiled pays nothing for it.
+#
+# A statement's total time includes everything it runs; its self time leaves
+# out the statements it runs, so a loop's self time is the time spent on its
+# condition or range. A recursive statement or func adds to its total once,
+# for the outermost run.
+
+# The words statements start with, for the collapsed stacks
+statement_kinds = {
+    AssignStatement: 'assign',
+    PrintStatement: 'print',
+    InputStatement: 'input',
+    IfStatement: 'if',
+    WhileStatement: 'while',
+    ForStatement: 'for',
+    FunctionStatement: 'func',
+    FunctionCall: 'call',
+    HoistedLoop: 'loop',
+    ReducedLoop: 'for',
+}
+
+
+class StatementStats:
+    def __init__(self, node):
+        self.node = node
+        self.count = 0
+        self.total = 0.0
+        self.self_time = 0.0
+
+    def __repr__(self):
+        return 'StatementStats(%s, %d, %.6f, %.6f)' % (label(self.node), self.count, self.total, self.self_time)
+
+
+class FunctionStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+
+    def __repr__(self):
+        return 'FunctionStats(%s, %d, %.6f)' % (self.name, self.calls, self.total)
+
+
+def label(node):
+    kind = statement_kinds.get(node.__class__, node.__class__.__name__)
+    if isinstance(node, FunctionCall):
+        kind += ' ' + node.name
+    if node.line is None:
+        return kind
+    return '%s:%d' % (kind, node.line)
+
+
+class ProfilingMachine(Machine):
+    def __init__(self, ast, env=None, clock=time.perf_counter):
+        Machine.__init__(self, ast, env)
+        self.clock = clock
+        # One entry per stack iterator, [node, start, time in children], or
+        # None for the iterator the program starts in
+        self.frames = [None]
+        self.statements = {}
+        self.functions = {}
+        # How many frames each statement and func has open, to spot recursion
+        self.active = {}
+        # The collapsed stack of each func call in progress, outermost first
+        self.calls = ['<main>']
+        self.stacks = {}
+
+    # Machine.run, timing each step and each frame
+    def run(self, steps=None):
+        stack = self.stack
+        frames = self.frames
+        handlers = self.handlers
+        clock = self.clock
+        budget = -1 if steps is None else steps
+        executed = 0
+        try:
+            while stack:
+                if budget == 0:
+                    return False
+                node = next(stack[-1], finished)
+                if node is finished:
+                    stack.pop()
+                    self.leave(frames.pop(), clock())
+                    continue
+                budget -= 1
+                executed += 1
+                start = clock()
+                handler = handlers.get(node.__class__)
+                if handler is None:
+                    raise RuntimeError('cannot step: {}'.format(node))
+                children = handler(node)
+                if children is not None:
+                    stack.append(children)
+                    frames.append(self.enter(node, start))
+                else:
+                    elapsed = clock() - start
+                    self.record(node, elapsed, elapsed)
+                    if frames[-1] is not None:
+                        frames[-1][2] += elapsed
+            return True
+        except Suspend:
+            return False
+        except:
+            stack.clear()
+            del frames[:]
+            raise
+        finally:
+            self.steps += executed
+
+    def enter(self, node, start):
+        key = id(node)
+        self.active[key] = self.active.get(key, 0) + 1
+        if node.__class__ is FunctionCall:
+            self.calls.append(self.calls[-1] + ';' + node.name)
+            self.active[node.name] = self.active.get(node.name, 0) + 1
+        return [node, start, 0.0]
+
+    def leave(self, frame, now):
+        if frame is None:
+            return
+        node, start, children = frame
+        elapsed = now - start
+        key = id(node)
+        self.active[key] -= 1
+        # A call statement runs in its caller, so its own stack is popped
+        # before its time is recorded
+        if node.__class__ is FunctionCall:
+            self.calls.pop()
+            self.active[node.name] -= 1
+            function = self.functions.get(node.name)
+            if function is None:
+                function = self.functions[node.name] = FunctionStats(node.name)
+            function.calls += 1
+            if not self.active[node.name]:
+                function.total += elapsed
+        self.record(node, elapsed if not self.active[key] else 0.0, elapsed - children)
+        if self.frames and self.frames[-1] is not None:
+            self.frames[-1][2] += elapsed
+
+    # Blocks are not statements of their own, so their time only counts
+    # towards the statement they are in
+    def record(self, node, total, self_time):
+        if node.__class__ in (BlockStatement, CompoundStatement):
+            return
+        stats = self.statements.get(id(node))
+        if stats is None:
+            stats = self.statements[id(node)] = StatementStats(node)
+        stats.count += 1
+        stats.total += total
+        stats.self_time += self_time
+        stack = self.calls[-1] + ';' + label(node)
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + self_time
+
+    # The statements that took longest, by self time, and every func
+    def report(self, top=20):
+        lines = ['{:>9} {:>10} {:>10}  {:<9} {}'.format('count', 'total', 'self', 'line:col', 'statement')]
+        ranked = sorted(self.statements.values(), key=lambda stats: stats.self_time, reverse=True)
+        for stats in ranked[:top]:
+            node = stats.node
+            where = '?' if node.line is None else '%d:%d' % (node.line, node.column)
+            text = repr(node)
+            if len(text) > 60:
+                text = text[:57] + '...'
+            lines.append('{:>9} {:>9.4f}s {:>9.4f}s  {:<9} {}'.format(
+                stats.count, stats.total, stats.self_time, where, text))
+        if self.functions:
+            lines.append('')
+            lines.append('{:>9} {:>10} {:>10}  {}'.format('calls', 'total', 'per call', 'func'))
+            for function in sorted(self.functions.values(), key=lambda function: function.total, reverse=True):
+                lines.append('{:>9} {:>9.4f}s {:>9.6f}s  {}'.format(
+                    function.calls, function.total, function.total / function.calls, function.name))
+        return '\n'.join(lines)
+
+    # Self time in microseconds by stack of func calls and statement, one
+    # "frame;frame;statement count" line each, as flame graph tools read
+    def collapsed(self):
+        return ''.join('%s %d\n' % (stack, round(seconds * 1e6))
+                       for stack, seconds in sorted(self.stacks.items()) if round(seconds * 1e6))
+
+
+def profile(ast, env=None):
+    machine = ProfilingMachine(ast, env)
+    machine.run()
+    return machine
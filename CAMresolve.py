@@ -0,0 +1,179 @@
+import collections.abc
+from CAMast import *
+
+
+# What an unassigned slot holds
+class Unbound:
+    def __repr__(self):
+        return 'UNBOUND'
+
+
+UNBOUND = Unbound()
+
+
+# A read of a variable that nothing in the program assigns, at the position
+# of the statement it is in. Such a read fails when it runs unless the
+# variable is passed in through env, so it is a warning rather than an error.
+Undefined = collections.namedtuple('Undefined', ['name', 'line', 'column'])
+
+
+# The result of resolving a program: a slot for every variable it names, the
+# variable reads that can skip the unbound check, and the reads of variables
+# nothing in the program assigns, as Undefined tuples in program order
+class Resolution:
+    def __init__(self, ast):
+        self.ast = ast
+        self.names = []
+        self.slots = {}
+        self.bound_reads = set()
+        self.undefined = []
+
+    def __repr__(self):
+        return 'Resolution(%s)' % ', '.join(self.names)
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    # True if node, a VarExp in the resolved tree, is always assigned by the
+    # time it is read
+    def is_bound(self, node):
+        return id(node) in self.bound_reads
+
+
+# Walks the tree carrying the set of variables that are assigned on every
+# path to the current statement. Variables are never unassigned, so a
+# function body starts with the set at its func statement.
+class Resolver:
+    def __init__(self, ast):
+        self.resolution = Resolution(ast)
+        self.assigned = set()
+        # Every read with the statement it is in
+        self.reads = []
+
+    def resolve(self):
+        ast = self.resolution.ast
+        self.statement(ast, frozenset())
+        self.resolution.undefined = [Undefined(read.name, statement.line, statement.column)
+                                     for read, statement in self.reads if read.name not in self.assigned]
+        return self.resolution
+
+    def bind(self, name, bound):
+        self.resolution.slot(name)
+        self.assigned.add(name)
+        return bound | {name}
+
+    def statement(self, node, bound):
+        if isinstance(node, BlockStatement):
+            for statement in node.statements:
+                bound = self.statement(statement, bound)
+            return bound
+        if isinstance(node, CompoundStatement):
+            return self.statement(node.second, self.statement(node.first, bound))
+        if isinstance(node, AssignStatement):
+            self.exp(node.exp, bound, node)
+            return self.bind(node.name, bound)
+        if isinstance(node, PrintStatement):
+            self.exp(node.exp, bound, node)
+            return bound
+        if isinstance(node, InputStatement):
+            return self.bind(node.name, bound)
+        if isinstance(node, IfStatement):
+            self.exp(node.condition, bound, node)
+            true_bound = self.statement(node.true_stmt, bound)
+            if not node.false_stmt:
+                return bound
+            return true_bound & self.statement(node.false_stmt, bound)
+        if isinstance(node, WhileStatement):
+            self.exp(node.condition, bound, node)
+            self.statement(node.body, bound)
+            return bound
+        if isinstance(node, ForStatement):
+            self.exp(node.start, bound, node)
+            self.exp(node.end, bound, node)
+            self.statement(node.body, self.bind(node.name, bound))
+            return bound
+        if isinstance(node, FunctionStatement):
+            bound = self.bind(node.name, bound)
+            self.statement(node.body, bound)
+            return bound
+        if isinstance(node, FunctionCall):
+            self.resolution.slot(node.name)
+            return bound
+        if isinstance(node, (HoistedLoop, ReducedLoop)):
+            return self.statement(node.loop, bound)
+        raise RuntimeError('cannot resolve: {}'.format(node))
+
+    def exp(self, node, bound, statement):
+        for read in reads(node):
+            self.reads.append((read, statement))
+            self.resolution.slot(read.name)
+            if read.name in bound:
+                self.resolution.bound_reads.add(id(read))
+
+
+def resolve(ast):
+    return Resolver(ast).resolve()
+
+
+# The VarExp nodes in an expression, in evaluation order
+def reads(node):
+    if isinstance(node, VarExp):
+        return [node]
+    if isinstance(node, (BinopAexp, RelopBexp, AndBexp, OrBexp)):
+        return reads(node.left) + reads(node.right)
+    if isinstance(node, (NotBexp, InvariantExp)):
+        return reads(node.exp)
+    return []
+
+
+# The variables of a resolved program as a list indexed by slot, with unset
+# slots holding UNBOUND
+class Frame:
+    def __init__(self, resolution, env=None):
+        self.names = resolution.names
+        self.slots = resolution.slots
+        self.values = [UNBOUND] * len(self.names)
+        if env:
+            for name, value in env.items():
+                slot = self.slots.get(name)
+                if slot is not None:
+                    self.values[slot] = value
+
+    def __repr__(self):
+        return 'Frame(%s)' % dict(self.view())
+
+    def view(self):
+        return FrameView(self)
+
+
+# A live dict view of the assigned variables in a frame
+class FrameView(collections.abc.MutableMapping):
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __getitem__(self, name):
+        value = self.frame.values[self.frame.slots[name]]
+        if value is UNBOUND:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        slot = self.frame.slots.get(name)
+        if slot is None:
+            raise RuntimeError('no slot for variable: {}'.format(name))
+        self.frame.values[slot] = value
+
+    def __delitem__(self, name):
+        self[name]
+        self.frame.values[self.frame.slots[name]] = UNBOUND
+
+    def __iter__(self):
+        values = self.frame.values
+        return (name for slot, name in enumerate(self.frame.names) if values[slot] is not UNBOUND)
+
+    def __len__(self):
+        return sum(1 for value in self.frame.values if value is not UNBOUND)
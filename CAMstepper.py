@@ -0,0 +1,174 @@
+import CAMio
+from CAMast import *
+
+# An evaluator that keeps its own stack instead of recursing through eval, so
+# a program can be paused after any number of steps and resumed later, and
+# recursive calls are limited by memory rather than by the Python stack.
+#
+# The stack holds an iterator per running statement that yields the
+# statements it runs next: a block yields its statements in turn, a while
+# loop yields its body for as long as its condition holds. A step is one
+# statement taken off the stack and executed. Expressions are still
+# evaluated with eval, as their depth is bounded by the parser's.
+
+# What next() returns for an iterator that has run out
+finished = object()
+
+
+# Raised by a handler to make run return False once its statement is done,
+# for instance to wait for input outside the machine
+class Suspend(Exception):
+    pass
+
+
+# A function defined by a func statement. Calling it runs its body with eval,
+# so code outside the stepper can still call it; the stepper itself pushes
+# the body onto its stack instead.
+class Function:
+    def __init__(self, name, body, env):
+        self.name = name
+        self.body = body
+        self.env = env
+
+    def __repr__(self):
+        return 'Function(%s)' % self.name
+
+    def __call__(self):
+        self.body.eval(self.env)
+
+
+class Machine:
+    def __init__(self, ast, env=None):
+        self.env = {} if env is None else env
+        self.stack = [iter((ast,))]
+        self.steps = 0
+        self.handlers = {
+            BlockStatement: self.block,
+            CompoundStatement: self.compound,
+            AssignStatement: self.assign,
+            PrintStatement: self.print_statement,
+            InputStatement: self.input_statement,
+            IfStatement: self.if_statement,
+            WhileStatement: self.while_loop,
+            ForStatement: self.for_loop,
+            FunctionStatement: self.function_statement,
+            FunctionCall: self.function_call,
+            HoistedLoop: self.hoisted_loop,
+            ReducedLoop: self.reduced_loop,
+        }
+
+    def __repr__(self):
+        return 'Machine(%d steps, %s)' % (self.steps, 'finished' if self.finished else 'running')
+
+    @property
+    def finished(self):
+        return not self.stack
+
+    # Runs at most steps statements, or to the end if steps is None, and
+    # returns True once the program has finished. An error ends the program,
+    # as it does with eval.
+    def run(self, steps=None):
+        stack = self.stack
+        handlers = self.handlers
+        env = self.env
+        # Counts down to zero; unlimited runs start below it
+        budget = -1 if steps is None else steps
+        executed = 0
+        try:
+            while stack:
+                if budget == 0:
+                    return False
+                node = next(stack[-1], finished)
+                if node is finished:
+                    stack.pop()
+                    continue
+                budget -= 1
+                executed += 1
+                # Assignments are most of what runs, so they skip the handler
+                if node.__class__ is AssignStatement:
+                    env[node.name] = node.exp.eval(env)
+                    continue
+                handler = handlers.get(node.__class__)
+                if handler is None:
+                    raise RuntimeError('cannot step: {}'.format(node))
+                children = handler(node)
+                if children is not None:
+                    stack.append(children)
+            return True
+        except Suspend:
+            return False
+        except:
+            stack.clear()
+            raise
+        finally:
+            self.steps += executed
+
+    # Output and input, for subclasses to redirect
+    def output(self, value):
+        CAMio.printer(self.env)(value)
+
+    def read_input(self):
+        return CAMio.read_input(self.env)
+
+    def block(self, node):
+        return iter(node.statements)
+
+    def compound(self, node):
+        return iter((node.first, node.second))
+
+    def assign(self, node):
+        self.env[node.name] = node.exp.eval(self.env)
+
+    def print_statement(self, node):
+        self.output(node.exp.eval(self.env))
+
+    def input_statement(self, node):
+        self.env[node.name] = self.read_input()
+
+    def if_statement(self, node):
+        if node.condition.eval(self.env):
+            return iter((node.true_stmt,))
+        if node.false_stmt:
+            return iter((node.false_stmt,))
+        return None
+
+    def while_loop(self, node):
+        env = self.env
+        while node.condition.eval(env):
+            yield node.body
+
+    def for_loop(self, node):
+        env = self.env
+        start = node.start.eval(env)
+        end = node.end.eval(env)
+        for i in range(start, end):
+            env[node.name] = i
+            yield node.body
+
+    def function_statement(self, node):
+        self.env[node.name] = Function(node.name, node.body, self.env)
+
+    def function_call(self, node):
+        function = self.env[node.name]
+        if isinstance(function, Function):
+            return iter((function.body,))
+        function()
+        return None
+
+    def hoisted_loop(self, node):
+        values = enter_invariants(node, self.env)
+        try:
+            yield node.loop
+        finally:
+            leave_invariants(node, self.env, values)
+
+    def reduced_loop(self, node):
+        if node.plan.run(self.env):
+            return None
+        return iter((node.loop,))
+
+
+def run(ast, env=None, steps=None):
+    machine = Machine(ast, env)
+    machine.run(steps)
+    return machine
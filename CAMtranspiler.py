@@ -0,0 +1,255 @@
+import hashlib, keyword
+import CAMio
+from CAMast import *
+
+# Lowers a CAMast tree to Python source and compiles it into a code object
+# that runs with the CAM environment as its globals, so CAM variables are
+# Python globals, loops are native loops and operators are native operators.
+#
+# Everything the generated code needs besides CAM variables is passed in as
+# its builtins under a name starting with '__', which no CAM identifier can,
+# so a CAM variable called range or print never shadows a helper.
+
+# Compiled code objects by sha256 of their Python source
+code_cache = {}
+cache_size = 256
+
+
+# and/or evaluate both sides before combining them, as AndBexp and OrBexp do
+def both_and(left, right):
+    return left and right
+
+
+def both_or(left, right):
+    return left or right
+
+
+helpers = {
+    '__range': range,
+    '__and': both_and,
+    '__or': both_or,
+    '__printer': CAMio.printer,
+}
+
+
+# A name Python cannot use as an identifier is read and written through the
+# environment dictionary instead
+def plain(name):
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def target(name):
+    return name if plain(name) else '__env[%r]' % name
+
+
+class Program:
+    def __init__(self, ast, source, code, plans=()):
+        self.ast = ast
+        self.source = source
+        self.code = code
+        self.plans = plans
+
+    def __repr__(self):
+        return 'Program(%s)' % ('compiled' if self.code else 'tree')
+
+
+class Transpiler:
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+        self.plans = []
+        # How many func bodies the statement being lowered is inside
+        self.functions = 0
+
+    def transpile(self, ast):
+        self.statement(ast)
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def statement(self, node):
+        method = getattr(self, 'visit_' + node.__class__.__name__, None)
+        if method is None:
+            raise RuntimeError('cannot transpile: {}'.format(node))
+        method(node)
+
+    def body(self, node):
+        self.depth += 1
+        self.statement(node)
+        self.depth -= 1
+
+    def visit_BlockStatement(self, node):
+        if not node.statements:
+            self.emit('pass')
+        for statement in node.statements:
+            self.statement(statement)
+
+    def visit_CompoundStatement(self, node):
+        self.statement(node.first)
+        self.statement(node.second)
+
+    def visit_AssignStatement(self, node):
+        self.emit('%s = %s' % (target(node.name), self.exp(node.exp)))
+
+    def visit_PrintStatement(self, node):
+        # A func can be called by a later run with another sink, so its
+        # prints look the sink up when they run, as PrintStatement.eval does
+        if self.functions:
+            self.emit('__printer(__env)(%s)' % self.exp(node.exp))
+        else:
+            self.emit('__print(%s)' % self.exp(node.exp))
+
+    def visit_InputStatement(self, node):
+        self.emit('%s = __input()' % target(node.name))
+
+    def visit_IfStatement(self, node):
+        self.emit('if %s:' % self.exp(node.condition))
+        self.body(node.true_stmt)
+        if node.false_stmt:
+            self.emit('else:')
+            self.body(node.false_stmt)
+
+    def visit_WhileStatement(self, node):
+        self.emit('while %s:' % self.exp(node.condition))
+        self.body(node.body)
+
+    def visit_ForStatement(self, node):
+        self.emit('for %s in __range(%s, %s):' % (
+            target(node.name), self.exp(node.start), self.exp(node.end)))
+        self.body(node.body)
+
+    # Each loop evaluates its invariants as it reaches them, which the
+    # generated code does anyway
+    def visit_HoistedLoop(self, node):
+        self.statement(node.loop)
+
+    def visit_ReducedLoop(self, node):
+        self.plans.append(node.plan)
+        self.emit('if not __plans[%d].run(__env):' % (len(self.plans) - 1))
+        self.body(node.loop)
+
+    def visit_FunctionCall(self, node):
+        # Looked up in the environment so an undefined function raises
+        # KeyError, as FunctionCall.eval does
+        self.emit('__env[%r]()' % node.name)
+
+    # Every name the body assigns is declared global, so a function shares
+    # the environment with the main program as it does in the tree walker
+    def visit_FunctionStatement(self, node):
+        function = node.name if plain(node.name) else '__function'
+        self.emit('def %s():' % function)
+        self.depth += 1
+        names = sorted(name for name in assigned(node.body) if plain(name))
+        if names:
+            self.emit('global ' + ', '.join(names))
+        self.functions += 1
+        self.statement(node.body)
+        self.functions -= 1
+        self.depth -= 1
+        if function != node.name:
+            self.emit('%s = %s' % (target(node.name), function))
+            self.emit('del ' + function)
+
+    def exp(self, node):
+        if isinstance(node, IntAexp):
+            return repr(node.i)
+        if isinstance(node, StringExp):
+            return repr(node.str.strip('"'))
+        if isinstance(node, VarExp):
+            return node.name if plain(node.name) else '__var(%r)' % node.name
+        if isinstance(node, BinopAexp):
+            if node.op not in ('+', '-', '*', '/'):
+                raise RuntimeError('unknown operator: ' + node.op)
+            return '(%s %s %s)' % (self.exp(node.left), node.op, self.exp(node.right))
+        if isinstance(node, RelopBexp):
+            if node.op not in ('<', '<=', '>', '>=', '==', '!='):
+                raise RuntimeError('unknown operator: ' + node.op)
+            return '(%s %s %s)' % (self.exp(node.left), node.op, self.exp(node.right))
+        if isinstance(node, AndBexp):
+            return '__and(%s, %s)' % (self.exp(node.left), self.exp(node.right))
+        if isinstance(node, OrBexp):
+            return '__or(%s, %s)' % (self.exp(node.left), self.exp(node.right))
+        if isinstance(node, NotBexp):
+            return '(not %s)' % self.exp(node.exp)
+        if isinstance(node, InvariantExp):
+            return self.exp(node.exp)
+        raise RuntimeError('cannot transpile: {}'.format(node))
+
+
+# Names a statement assigns, not counting those inside nested functions
+def assigned(node):
+    if isinstance(node, BlockStatement):
+        names = set()
+        for statement in node.statements:
+            names |= assigned(statement)
+        return names
+    if isinstance(node, CompoundStatement):
+        return assigned(node.first) | assigned(node.second)
+    if isinstance(node, (AssignStatement, InputStatement, FunctionStatement)):
+        return {node.name}
+    if isinstance(node, IfStatement):
+        return assigned(node.true_stmt) | (assigned(node.false_stmt) if node.false_stmt else set())
+    if isinstance(node, WhileStatement):
+        return assigned(node.body)
+    if isinstance(node, ForStatement):
+        return {node.name} | assigned(node.body)
+    if isinstance(node, (HoistedLoop, ReducedLoop)):
+        return assigned(node.loop)
+    return set()
+
+
+def transpile(ast):
+    return Transpiler().transpile(ast)
+
+
+# Returns a Program for ast. If Python cannot compile the generated source,
+# for instance because loops are nested deeper than it allows, the Program
+# has no code and run falls back to the tree walker.
+def compile_ast(ast):
+    transpiler = Transpiler()
+    try:
+        source = transpiler.transpile(ast)
+    except RecursionError:
+        return Program(ast, None, None)
+    key = hashlib.sha256(source.encode()).hexdigest()
+    code = code_cache.get(key)
+    if code is None:
+        try:
+            code = compile(source, '<cam>', 'exec')
+        except (SyntaxError, RecursionError, MemoryError, ValueError):
+            return Program(ast, source, None)
+        if len(code_cache) >= cache_size:
+            # Another thread may take the same entry out first
+            code_cache.pop(next(iter(code_cache), None), None)
+        code_cache[key] = code
+    return Program(ast, source, code, transpiler.plans)
+
+
+# Runs a Program against env, a dict of variables like the one ast.eval takes,
+# and returns it
+def run(program, env=None):
+    if env is None:
+        env = {}
+    if program.code is None:
+        program.ast.eval(env)
+        return env
+
+    def read_variable(name):
+        if name in env:
+            return env[name]
+        raise RuntimeError("Variable not defined: {}".format(name))
+
+    builtins = dict(helpers, __env=env, __var=read_variable, __plans=program.plans,
+                    __print=CAMio.printer(env), __input=lambda: CAMio.read_input(env))
+    env['__builtins__'] = builtins
+    try:
+        exec(program.code, env)
+    except NameError as error:
+        raise RuntimeError("Variable not defined: {}".format(error.name))
+    finally:
+        # Functions keep the builtins they were defined with, so they still
+        # work after the key is gone. They only reach the environment they
+        # were defined in through them, never this run's sink.
+        env.pop('__builtins__', None)
+    return env
@@ -0,0 +1,447 @@
+import array, operator
+import CAMio, CAMoptimize, CAMresolve
+from CAMast import *
+from CAMresolve import UNBOUND
+
+# Opcodes. Every instruction is an (opcode, a, b) triple of ints in
+# Program.code. Statements and control flow are instructions; each expression
+# is compiled once into a Python closure that instructions refer to by index,
+# so evaluating one costs no dispatch and no string comparison on the operator.
+ASSIGN = 0
+FOR_ITER = 1
+JUMP_IF_FALSE = 2
+JUMP = 3
+PRINT = 4
+CALL = 5
+RETURN = 6
+FOR_RANGE = 7
+INPUT = 8
+DEFINE = 9
+HALT = 10
+REDUCE = 11
+
+opnames = ['ASSIGN', 'FOR_ITER', 'JUMP_IF_FALSE', 'JUMP', 'PRINT', 'CALL', 'RETURN',
+           'FOR_RANGE', 'INPUT', 'DEFINE', 'HALT', 'REDUCE']
+
+binop_functions = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}
+relop_functions = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+                   '==': operator.eq, '!=': operator.ne}
+
+# What next() returns to FOR_ITER once a loop's range has run out
+exhausted = object()
+
+
+# A function defined by a func statement; calling it jumps to entry in the
+# code of program. slots are the variables its body, and the program's funcs
+# it calls, can read or write.
+class Function:
+    def __init__(self, name, entry, program):
+        self.name = name
+        self.entry = entry
+        self.program = program
+        self.slots = ()
+
+    def __repr__(self):
+        return 'Function(%s, %d)' % (self.name, self.entry)
+
+
+# What a Function is written back to env as once its program has run: a
+# callable that runs the function's code against env, as the func statements
+# ast.eval runs leave behind, so the tree, other backends and other programs
+# can call it
+class BoundFunction:
+    def __init__(self, function, env):
+        self.function = function
+        self.env = env
+
+    def __repr__(self):
+        return 'BoundFunction(%s)' % self.function.name
+
+    # Only the function's own slots are copied in and out, so a call costs
+    # what the function uses rather than the size of its program
+    def __call__(self):
+        function = self.function
+        program = function.program
+        frame = CAMresolve.Frame(program.resolution)
+        load(program, frame, self.env, function.slots)
+        try:
+            execute(program, frame, self.env, function.entry)
+        finally:
+            store(program, frame, self.env, function.slots)
+
+
+class Program:
+    def __init__(self, resolution):
+        self.code = array.array('i')
+        # code as a list, which gives the loop ready-made int objects instead
+        # of boxing a new one on every read from the array
+        self.ops = []
+        self.resolution = resolution
+        self.names = resolution.names
+        self.functions = []
+        self.exprs = []
+        self.expr_nodes = []
+        self.plans = []
+
+    def disassemble(self):
+        lines = []
+        for pc in range(0, len(self.code), 3):
+            op, a, b = self.code[pc:pc + 3]
+            if op == ASSIGN:
+                detail = '%s = %s' % (self.names[a], self.expr_nodes[b])
+            elif op == FOR_ITER:
+                detail = '%s, to %d' % (self.names[a], b)
+            elif op == JUMP_IF_FALSE:
+                detail = '%s, to %d' % (self.expr_nodes[a], b)
+            elif op == JUMP:
+                detail = 'to %d' % a
+            elif op == PRINT:
+                detail = self.expr_nodes[a]
+            elif op == FOR_RANGE:
+                detail = '%s to %s' % (self.expr_nodes[a], self.expr_nodes[b])
+            elif op in (CALL, INPUT):
+                detail = self.names[a]
+            elif op == DEFINE:
+                detail = '%s = %s' % (self.names[a], self.functions[b])
+            elif op == REDUCE:
+                detail = '%s, to %d' % (self.plans[a], b)
+            else:
+                detail = ''
+            lines.append('%5d %-14s %s' % (pc, opnames[op], detail))
+        return '\n'.join(lines)
+
+
+# Returns a closure that evaluates an expression node against a frame, the
+# list of variable values indexed by the slots in resolution. Only reads the
+# resolver could not prove assigned check for UNBOUND.
+def expression(node, resolution):
+    slots = resolution.slots
+    if isinstance(node, IntAexp):
+        value = node.i
+        return lambda frame: value
+    if isinstance(node, StringExp):
+        value = node.str.strip('"')
+        return lambda frame: value
+    if isinstance(node, VarExp):
+        name, slot = node.name, slots[node.name]
+        if resolution.is_bound(node):
+            return lambda frame: frame[slot]
+
+        def read_checked(frame):
+            value = frame[slot]
+            if value is UNBOUND:
+                raise RuntimeError("Variable not defined: {}".format(name))
+            return value
+        return read_checked
+    if isinstance(node, (BinopAexp, RelopBexp)):
+        functions = binop_functions if isinstance(node, BinopAexp) else relop_functions
+        if node.op not in functions:
+            raise RuntimeError('unknown operator: ' + node.op)
+        function = functions[node.op]
+        left, right = node.left, node.right
+        left_var = isinstance(left, VarExp) and resolution.is_bound(left)
+        right_var = isinstance(right, VarExp) and resolution.is_bound(right)
+        # Assigned variables and constants on either side are read inline
+        if left_var and right_var:
+            a, b = slots[left.name], slots[right.name]
+            return lambda frame: function(frame[a], frame[b])
+        if left_var and isinstance(right, IntAexp):
+            a, b = slots[left.name], right.i
+            return lambda frame: function(frame[a], b)
+        if isinstance(left, IntAexp) and right_var:
+            a, b = left.i, slots[right.name]
+            return lambda frame: function(a, frame[b])
+        if right_var:
+            evaluate_left, b = expression(left, resolution), slots[right.name]
+            return lambda frame: function(evaluate_left(frame), frame[b])
+        if isinstance(right, IntAexp):
+            evaluate_left, b = expression(left, resolution), right.i
+            return lambda frame: function(evaluate_left(frame), b)
+        evaluate_left, evaluate_right = expression(left, resolution), expression(right, resolution)
+        return lambda frame: function(evaluate_left(frame), evaluate_right(frame))
+    if isinstance(node, AndBexp):
+        evaluate_left, evaluate_right = expression(node.left, resolution), expression(node.right, resolution)
+
+        def evaluate_and(frame):
+            left_value = evaluate_left(frame)
+            right_value = evaluate_right(frame)
+            return left_value and right_value
+        return evaluate_and
+    if isinstance(node, OrBexp):
+        evaluate_left, evaluate_right = expression(node.left, resolution), expression(node.right, resolution)
+
+        def evaluate_or(frame):
+            left_value = evaluate_left(frame)
+            right_value = evaluate_right(frame)
+            return left_value or right_value
+        return evaluate_or
+    if isinstance(node, NotBexp):
+        evaluate = expression(node.exp, resolution)
+        return lambda frame: not evaluate(frame)
+    if isinstance(node, InvariantExp):
+        return expression(node.exp, resolution)
+    raise RuntimeError('cannot compile: {}'.format(node))
+
+
+# Compiles a CAMast tree into a Program. Function bodies are laid out after
+# the HALT that ends the main code.
+class Compiler:
+    def __init__(self, resolution):
+        self.program = Program(resolution)
+        self.pending = []
+
+    def compile(self, ast):
+        self.visit(ast)
+        self.emit(HALT)
+        bodies = []
+        while self.pending:
+            function, body = self.pending.pop(0)
+            bodies.append((function, body))
+            function.entry = self.here()
+            self.visit(body)
+            self.emit(RETURN)
+        self.function_slots(bodies)
+        self.program.ops = self.program.code.tolist()
+        return self.program
+
+    # Sets each function's slots to the variables named in its body and in the
+    # bodies of the funcs of this program it may call, directly or not
+    def function_slots(self, bodies):
+        named = dict((function, names(body)) for function, body in bodies)
+        by_name = {}
+        for function, body in bodies:
+            by_name.setdefault(function.name, []).append(function)
+        changed = True
+        while changed:
+            changed = False
+            for function in named:
+                for callee_name in list(named[function]):
+                    for callee in by_name.get(callee_name, ()):
+                        if not named[callee] <= named[function]:
+                            named[function] |= named[callee]
+                            changed = True
+        slots = self.program.resolution.slots
+        for function, used in named.items():
+            function.slots = sorted(slots[name] for name in used if name in slots)
+
+    def here(self):
+        return len(self.program.code)
+
+    def emit(self, op, a=0, b=0):
+        self.program.code.extend((op, a, b))
+        return self.here() - 3
+
+    def patch(self, pc, slot, target):
+        self.program.code[pc + slot] = target
+
+    def name(self, name):
+        return self.program.resolution.slots[name]
+
+    def expr(self, node):
+        self.program.exprs.append(expression(node, self.program.resolution))
+        self.program.expr_nodes.append(node)
+        return len(self.program.exprs) - 1
+
+    def visit(self, node):
+        method = getattr(self, 'visit_' + node.__class__.__name__, None)
+        if method is None:
+            raise RuntimeError('cannot compile: {}'.format(node))
+        method(node)
+
+    def visit_BlockStatement(self, node):
+        for statement in node.statements:
+            self.visit(statement)
+
+    def visit_CompoundStatement(self, node):
+        self.visit(node.first)
+        self.visit(node.second)
+
+    def visit_AssignStatement(self, node):
+        self.emit(ASSIGN, self.name(node.name), self.expr(node.exp))
+
+    def visit_PrintStatement(self, node):
+        self.emit(PRINT, self.expr(node.exp))
+
+    def visit_InputStatement(self, node):
+        self.emit(INPUT, self.name(node.name))
+
+    def visit_IfStatement(self, node):
+        false_jump = self.emit(JUMP_IF_FALSE, self.expr(node.condition))
+        self.visit(node.true_stmt)
+        if node.false_stmt:
+            end_jump = self.emit(JUMP)
+            self.patch(false_jump, 2, self.here())
+            self.visit(node.false_stmt)
+            self.patch(end_jump, 1, self.here())
+        else:
+            self.patch(false_jump, 2, self.here())
+
+    def visit_WhileStatement(self, node):
+        loop = self.emit(JUMP_IF_FALSE, self.expr(node.condition))
+        self.visit(node.body)
+        self.emit(JUMP, loop)
+        self.patch(loop, 2, self.here())
+
+    # FOR_RANGE pushes an iterator over the range, FOR_ITER stores its next
+    # value or pops it and leaves the loop
+    def visit_ForStatement(self, node):
+        self.emit(FOR_RANGE, self.expr(node.start), self.expr(node.end))
+        loop = self.emit(FOR_ITER, self.name(node.name))
+        self.visit(node.body)
+        self.emit(JUMP, loop)
+        self.patch(loop, 2, self.here())
+
+    def visit_HoistedLoop(self, node):
+        self.visit(node.loop)
+
+    # REDUCE skips the loop when its plan ran it
+    def visit_ReducedLoop(self, node):
+        self.program.plans.append(node.plan)
+        reduce = self.emit(REDUCE, len(self.program.plans) - 1)
+        self.visit(node.loop)
+        self.patch(reduce, 2, self.here())
+
+    def visit_FunctionStatement(self, node):
+        function = Function(node.name, -1, self.program)
+        self.pending.append((function, node.body))
+        self.program.functions.append(function)
+        self.emit(DEFINE, self.name(node.name), len(self.program.functions) - 1)
+
+    def visit_FunctionCall(self, node):
+        self.emit(CALL, self.name(node.name))
+
+
+# Every variable and func name in a statement or expression
+def names(node):
+    found = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        name = getattr(node, 'name', None)
+        if name is not None:
+            found.add(name)
+        stack.extend(CAMoptimize.children(node))
+    return found
+
+
+def compile_ast(ast):
+    return Compiler(CAMresolve.resolve(ast)).compile(ast)
+
+
+# Runs a Program against env, a dict of variables like the one ast.eval takes,
+# and returns it. The program runs on a frame loaded from env, and the
+# variables it assigned are copied back at the end.
+def run(program, env=None):
+    if env is None:
+        env = {}
+    frame = CAMresolve.Frame(program.resolution)
+    load(program, frame, env)
+    try:
+        execute(program, frame, env)
+    finally:
+        store(program, frame, env)
+    return env
+
+
+# Copies the assigned variables in frame_object, or in its slots given, to
+# env, binding the program's functions to env
+def store(program, frame_object, env, slots=None):
+    frame = frame_object.values
+    names = frame_object.names
+    for slot in range(len(frame)) if slots is None else slots:
+        value = frame[slot]
+        if value is UNBOUND:
+            continue
+        if value.__class__ is Function:
+            value = BoundFunction(value, env)
+        env[names[slot]] = value
+
+
+# Copies the variables in env to frame_object, or to its slots given,
+# unbinding the program's own functions so calls to them jump straight to
+# their code again
+def load(program, frame_object, env, slots=None):
+    frame = frame_object.values
+    names = frame_object.names
+    for slot in range(len(frame)) if slots is None else slots:
+        value = env.get(names[slot], UNBOUND)
+        if value.__class__ is BoundFunction and value.function.program is program and value.env is env:
+            value = value.function
+        frame[slot] = value
+
+
+# Runs program on frame_object, a CAMresolve.Frame, from entry until HALT or
+# until the function entry starts in returns. env supplies the output sink,
+# and is only read and written around calls to functions that are not
+# program's, which see and change the variables through it.
+def execute(program, frame_object, env, entry=0):
+    frame = frame_object.values
+    output = CAMio.printer(env)
+    code = program.ops
+    names = program.names
+    exprs = program.exprs
+    functions = program.functions
+    loops = []
+    calls = []
+    pc = entry
+    while True:
+        op = code[pc]
+        if op == ASSIGN:
+            frame[code[pc + 1]] = exprs[code[pc + 2]](frame)
+            pc += 3
+        elif op == FOR_ITER:
+            value = next(loops[-1], exhausted)
+            if value is exhausted:
+                loops.pop()
+                pc = code[pc + 2]
+            else:
+                frame[code[pc + 1]] = value
+                pc += 3
+        elif op == JUMP_IF_FALSE:
+            if exprs[code[pc + 1]](frame):
+                pc += 3
+            else:
+                pc = code[pc + 2]
+        elif op == JUMP:
+            pc = code[pc + 1]
+        elif op == PRINT:
+            output(exprs[code[pc + 1]](frame))
+            pc += 3
+        elif op == CALL:
+            function = frame[code[pc + 1]]
+            pc += 3
+            if function.__class__ is Function:
+                if function.program is not program:
+                    raise RuntimeError('cannot call {}: it belongs to another program'.format(function.name))
+                calls.append(pc)
+                pc = function.entry
+            elif function is UNBOUND:
+                # As FunctionCall.eval does
+                raise KeyError(names[code[pc - 2]])
+            else:
+                store(program, frame_object, env)
+                function()
+                load(program, frame_object, env)
+        elif op == RETURN:
+            if not calls:
+                return frame
+            pc = calls.pop()
+        elif op == FOR_RANGE:
+            start = exprs[code[pc + 1]](frame)
+            loops.append(iter(range(start, exprs[code[pc + 2]](frame))))
+            pc += 3
+        elif op == INPUT:
+            frame[code[pc + 1]] = CAMio.read_input(env)
+            pc += 3
+        elif op == DEFINE:
+            frame[code[pc + 1]] = functions[code[pc + 2]]
+            pc += 3
+        elif op == REDUCE:
+            if program.plans[code[pc + 1]].run(frame_object.view()):
+                pc = code[pc + 2]
+            else:
+                pc += 3
+        elif op == HALT:
+            return frame
+        else:
+            raise RuntimeError('unknown opcode: {}'.format(op))
@@ -1,5 +1,5 @@
 # Setting up imports
-import tkinter, re, CAM
+import tkinter, re, CAM, CAMio
 from tkinter import filedialog
 
 # Class declaration
@@ -138,9 +138,11 @@ class Pad:
     def Run(self, event=None):
         # Save file first
         self.Save()
-        print('\n'*50)
+        # Output is written in large blocks rather than a line at a time
+        sink = CAMio.BufferedSink()
+        sink.write('\n'*50)
         # Call the CAM interpreter to compile the code and return the environment created
-        env = CAM.main(self.filePath)
+        env = CAM.main(self.filePath, sink=sink)
 
 
     # Function that creates the find and replace window
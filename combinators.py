@@ -1,4 +1,9 @@
+import time
+
+
 class Result:
+    __slots__ = ('value', 'pos')
+
     def __init__(self, value, pos):
         self.value = value
         self.pos = pos
@@ -7,7 +12,24 @@ class Result:
         return "Result({}, {})".format(self.value, self.pos)
 
 
+# Token sequences may be lazy streams without a length, so the end of input
+# is found by indexing past it
+def at_end(tokens, pos):
+    try:
+        tokens[pos]
+    except IndexError:
+        return True
+    return False
+
+
+# FIRST sets are frozensets of (text, tag) keys for the tokens a parser can
+# start with, where a text of None matches any token with that tag. None
+# instead of a set means unknown, for parsers that can match without
+# consuming a token.
 class Parser:
+    def first(self, visiting=frozenset()):
+        return None
+
     def __add__(self, other):
         return Concat(self, other)
 
@@ -26,22 +48,36 @@ class Tag(Parser):
         self.tag = tag
 
     def __call__(self, tokens, pos):
-        if pos < len(tokens) and tokens[pos][1] is self.tag:
-            return Result(tokens[pos][0], pos + 1)
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        if token[1] is self.tag:
+            return Result(token[0], pos + 1)
         else:
             return None
 
+    def first(self, visiting=frozenset()):
+        return frozenset([(None, self.tag)])
+
 
 class String(Parser):
     def __init__(self, str):
         self.str = str
 
     def __call__(self, tokens, pos):
-        if pos < len(tokens) and tokens[pos][1] is self.str:
-            return Result(tokens[pos][0], pos + 1)
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        if token[1] is self.str:
+            return Result(token[0], pos + 1)
         else:
             return None
 
+    def first(self, visiting=frozenset()):
+        return frozenset([(None, self.str)])
+
 
 class Reserved(Parser):
     def __init__(self, value, tag):
@@ -49,12 +85,18 @@ class Reserved(Parser):
         self.tag = tag
 
     def __call__(self, tokens, pos):
-        if pos < len(tokens) and \
-                        tokens[pos][0] == self.value and tokens[pos][1] is self.tag:
-            return Result(tokens[pos][0], pos + 1)
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        if token[0] == self.value and token[1] is self.tag:
+            return Result(token[0], pos + 1)
         else:
             return None
 
+    def first(self, visiting=frozenset()):
+        return frozenset([(self.value, self.tag)])
+
 
 class Concat(Parser):
     def __init__(self, left, right):
@@ -70,6 +112,9 @@ class Concat(Parser):
                 return Result(combined_value, right_result.pos)
         return None
 
+    def first(self, visiting=frozenset()):
+        return self.left.first(visiting)
+
 
 class Exp(Parser):
     def __init__(self, parser, separator):
@@ -77,21 +122,22 @@ class Exp(Parser):
         self.separator = separator
 
     def __call__(self, tokens, pos):
-        result = self.parser(tokens, pos)
-
-        def process_next(parsed):
-            (sepfunc, right) = parsed
-            return sepfunc(result.value, right)
-
-        next_parser = self.separator + self.parser ^ process_next
-
-        next_result = result
-        while next_result:
-            next_result = next_parser(tokens, result.pos)
-            if next_result:
-                result = next_result
+        parser = self.parser
+        separator = self.separator
+        result = parser(tokens, pos)
+        while result:
+            separator_result = separator(tokens, result.pos)
+            if not separator_result:
+                break
+            right_result = parser(tokens, separator_result.pos)
+            if not right_result:
+                break
+            result = Result(separator_result.value(result.value, right_result.value), right_result.pos)
         return result
 
+    def first(self, visiting=frozenset()):
+        return self.parser.first(visiting)
+
 
 class Alternate(Parser):
     def __init__(self, left, right):
@@ -106,6 +152,9 @@ class Alternate(Parser):
             right_result = self.right(tokens, pos)
             return right_result
 
+    def first(self, visiting=frozenset()):
+        return union_first([self.left, self.right], visiting)
+
 
 class Opt(Parser):
     def __init__(self, parser):
@@ -141,8 +190,10 @@ class Process(Parser):
     def __call__(self, tokens, pos):
         result = self.parser(tokens, pos)
         if result:
-            result.value = self.function(result.value)
-            return result
+            return Result(self.function(result.value), result.pos)
+
+    def first(self, visiting=frozenset()):
+        return self.parser.first(visiting)
 
 
 class Lazy(Parser):
@@ -152,9 +203,18 @@ class Lazy(Parser):
 
     def __call__(self, tokens, pos):
         if not self.parser:
+            # Grammar functions return cached parsers, so threads racing to
+            # resolve this store the same object
             self.parser = self.parser_func()
         return self.parser(tokens, pos)
 
+    def first(self, visiting=frozenset()):
+        if self in visiting:
+            return None
+        if not self.parser:
+            self.parser = self.parser_func()
+        return self.parser.first(visiting | {self})
+
 
 class Phrase(Parser):
     def __init__(self, parser):
@@ -162,7 +222,238 @@ class Phrase(Parser):
 
     def __call__(self, tokens, pos):
         result = self.parser(tokens, pos)
-        if result and result.pos == len(tokens):
+        if result and at_end(tokens, result.pos):
             return result
         else:
             return None
+
+    def first(self, visiting=frozenset()):
+        return self.parser.first(visiting)
+
+
+# Per-parse state for packrat parsing. It stands in for the token sequence,
+# so the memo table lives exactly as long as one parse call.
+class Packrat:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.memo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, pos):
+        return self.tokens[pos]
+
+
+class RuleStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        # Calls at a position the rule had already been tried at
+        self.repeats = 0
+        self.memo_hits = 0
+        # Tokens the rule looked at in calls that failed
+        self.backtracked = 0
+        self.time = 0.0
+        self.self_time = 0.0
+
+    def __repr__(self):
+        return 'RuleStats({}, {} calls, {} ok, {} failed)'.format(self.name, self.calls, self.successes,
+                                                                 self.failures)
+
+
+# Per-parse state for instrumented parsing, standing in for the token
+# sequence as Packrat does. Every named Rule records its calls, successes
+# and failures, how many tokens it read in the calls that failed, how often
+# it was tried again at the same position, and the time spent in it. Time
+# is inclusive, counted once for recursive calls, and self time leaves out
+# the rules it called. With packrat results are memoised too.
+class Instrumented:
+    def __init__(self, tokens, packrat=False, clock=time.perf_counter):
+        self.tokens = tokens
+        self.memo = {} if packrat else None
+        self.clock = clock
+        self.rules = {}
+        self.seen = set()
+        self.active = {}
+        # Time spent in rules called by each rule in progress
+        self.children = [0.0]
+        # The furthest token read since the current rule started
+        self.furthest = -1
+
+    def __getitem__(self, pos):
+        if pos > self.furthest:
+            self.furthest = pos
+        return self.tokens[pos]
+
+    def call(self, rule, pos):
+        name = rule.name
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats(name)
+        key = (name, pos)
+        if self.memo is not None and key in self.memo:
+            stats.memo_hits += 1
+            return self.memo[key]
+        stats.calls += 1
+        if key in self.seen:
+            stats.repeats += 1
+        else:
+            self.seen.add(key)
+
+        outer_furthest = self.furthest
+        self.furthest = pos - 1
+        self.active[name] = self.active.get(name, 0) + 1
+        self.children.append(0.0)
+        start = self.clock()
+        try:
+            result = rule.parser(self, pos)
+        finally:
+            elapsed = self.clock() - start
+            children = self.children.pop()
+            self.active[name] -= 1
+            if not self.active[name]:
+                stats.time += elapsed
+            stats.self_time += elapsed - children
+            self.children[-1] += elapsed
+            read = self.furthest
+            self.furthest = max(outer_furthest, read)
+
+        if result:
+            stats.successes += 1
+        else:
+            stats.failures += 1
+            stats.backtracked += max(0, read - pos + 1)
+        if self.memo is not None:
+            self.memo[key] = result
+        return result
+
+    # The rules that took longest, one line each
+    def report(self):
+        lines = ['{:<16} {:>8} {:>8} {:>8} {:>8} {:>11} {:>9} {:>9}'.format(
+            'rule', 'calls', 'ok', 'failed', 'repeats', 'backtracked', 'time', 'self')]
+        for stats in sorted(self.rules.values(), key=lambda stats: stats.time, reverse=True):
+            lines.append('{:<16} {:>8} {:>8} {:>8} {:>8} {:>11} {:>8.4f}s {:>8.4f}s'.format(
+                stats.name, stats.calls, stats.successes, stats.failures, stats.repeats, stats.backtracked,
+                stats.time, stats.self_time))
+        if self.memo is not None:
+            lines.append('memo hits: {}'.format(sum(stats.memo_hits for stats in self.rules.values())))
+        return '\n'.join(lines)
+
+
+# (line, column) of the token at pos, from the token itself or from a token
+# sequence that keeps positions apart from its tokens, or None if neither
+# knows it
+def position(tokens, pos):
+    if tokens.__class__ is Packrat or tokens.__class__ is Instrumented:
+        tokens = tokens.tokens
+    try:
+        token = tokens[pos]
+    except IndexError:
+        return None
+    if len(token) >= 4:
+        return token[2], token[3]
+    locate = getattr(tokens, 'position', None)
+    return locate(pos) if locate is not None else None
+
+
+# Sets line and column on the node a parser returns to the position of the
+# token it starts at, when the tokens know it
+class Located(Parser):
+    def __init__(self, parser):
+        self.parser = parser
+
+    def __call__(self, tokens, pos):
+        result = self.parser(tokens, pos)
+        if result:
+            where = position(tokens, pos)
+            if where is not None:
+                result.value.line, result.value.column = where
+        return result
+
+    def first(self, visiting=frozenset()):
+        return self.parser.first(visiting)
+
+
+# A named grammar rule. When parsing a Packrat its result at each position is
+# computed once and then served from the memo table; when parsing an
+# Instrumented its calls are recorded.
+class Rule(Parser):
+    def __init__(self, parser, name):
+        self.parser = parser
+        self.name = name
+
+    def __call__(self, tokens, pos):
+        if tokens.__class__ is not Packrat:
+            if tokens.__class__ is Instrumented:
+                return tokens.call(self, pos)
+            return self.parser(tokens, pos)
+        key = (self.name, pos)
+        memo = tokens.memo
+        if key in memo:
+            tokens.hits += 1
+            return memo[key]
+        tokens.misses += 1
+        result = memo[key] = self.parser(tokens, pos)
+        return result
+
+    def first(self, visiting=frozenset()):
+        return self.parser.first(visiting)
+
+
+def union_first(parsers, visiting=frozenset()):
+    keys = set()
+    for parser in parsers:
+        first = parser.first(visiting)
+        if first is None:
+            return None
+        keys |= first
+    return frozenset(keys)
+
+
+# An ordered choice that looks at the next token and only tries the
+# alternatives whose FIRST set admits it, in their original order. Overlapping
+# alternatives and ones with an unknown FIRST set are still tried in turn.
+class Dispatch(Parser):
+    def __init__(self, *parsers):
+        self.parsers = parsers
+        self.tables = None
+
+    def first(self, visiting=frozenset()):
+        return union_first(self.parsers, visiting)
+
+    def build_tables(self):
+        firsts = [parser.first() for parser in self.parsers]
+
+        def viable(key):
+            return tuple(parser for parser, first in zip(self.parsers, firsts)
+                         if first is None or key in first or (None, key[1]) in first)
+
+        keys = set()
+        for first in firsts:
+            if first is not None:
+                keys |= first
+        keys |= set((None, tag) for (text, tag) in keys)
+        table = dict((key, viable(key)) for key in keys)
+        default = tuple(parser for parser, first in zip(self.parsers, firsts) if first is None)
+        return table, default
+
+    def __call__(self, tokens, pos):
+        if self.tables is None:
+            # Built on first use, once every Lazy in the grammar can resolve
+            self.tables = self.build_tables()
+        table, default = self.tables
+        try:
+            token = tokens[pos]
+        except IndexError:
+            parsers = default
+        else:
+            parsers = table.get((token[0], token[1]))
+            if parsers is None:
+                parsers = table.get((None, token[1]), default)
+        for parser in parsers:
+            result = parser(tokens, pos)
+            if result:
+                return result
+        return None
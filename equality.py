@@ -1,6 +1,16 @@
+# Where a node came from in the source is not part of what it is
+position_keys = ('line', 'column')
+
+
 class Equality:
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
+        if not isinstance(other, self.__class__):
+            return False
+        mine, theirs = self.__dict__, other.__dict__
+        if 'line' in mine or 'line' in theirs:
+            mine = dict((key, value) for key, value in mine.items() if key not in position_keys)
+            theirs = dict((key, value) for key, value in theirs.items() if key not in position_keys)
+        return mine == theirs
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -0,0 +1,5 @@
+import os, sys
+
+# The modules live at the top of the repository rather than in a package, so
+# the tests import them from there however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
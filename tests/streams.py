@@ -0,0 +1,19 @@
+# Stand-ins for the asyncio streams CAMasync.run_async reads and writes
+
+
+# Hands out lines as an asyncio.StreamReader's readline() would, then b''
+class Lines:
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    async def readline(self):
+        return (self.lines.pop(0) + '\n').encode() if self.lines else b''
+
+
+# Collects what is written as an asyncio.StreamWriter would send it
+class Output:
+    def __init__(self):
+        self.written = b''
+
+    def write(self, data):
+        self.written += data
@@ -0,0 +1,45 @@
+import asyncio, unittest
+import CAM, CAMasync, CAMio, CAMlexer, CAMparser
+from streams import Lines, Output
+
+# Programs and the lines their input statements read
+programs = [
+    ('x = 1; while x < 500 do x = x * 3 end; print x', []),
+    ('input a; input b; print a + b; print "done"', ['2', '40']),
+    ('input n; s = 0; for i = 1 to n do s = s + i; if s > 50 then print s end end; print i', ['14']),
+    ('func f do n = n - 1; print n; if n > 0 then call f end end; input n; call f', ['6']),
+    ('input a; print a; input b; print b', ['-3', 'word']),
+]
+
+
+def parsed(source):
+    return CAMparser.parse(CAMlexer.lex(source)).value
+
+
+def blocking(source, lines):
+    sink = CAMio.CaptureSink()
+    CAM.run(source, inputs=lines, sink=sink, backend='tree')
+    return sink.getvalue().encode()
+
+
+class TestAsync(unittest.TestCase):
+    def test_output_matches_blocking_run(self):
+        for source, lines in programs:
+            for slice_steps in (1, 3, 1000):
+                with self.subTest(source=source, slice_steps=slice_steps):
+                    output = Output()
+                    asyncio.run(CAMasync.run_async(parsed(source), Lines(lines), output, slice_steps=slice_steps))
+                    self.assertEqual(output.written, blocking(source, lines))
+
+    def test_concurrent_programs_match_blocking_runs(self):
+        async def run_all():
+            outputs = [Output() for _ in programs]
+            await asyncio.gather(*[CAMasync.run_async(parsed(source), Lines(lines), output, slice_steps=2)
+                                   for (source, lines), output in zip(programs, outputs)])
+            return [output.written for output in outputs]
+
+        self.assertEqual(asyncio.run(run_all()), [blocking(source, lines) for source, lines in programs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import CAM, CAMio, CAMlexer, CAMparser, CAMvm
+
+backends = ['tree', 'vm', 'python', 'stepper']
+
+
+def run(source, backend, env=None):
+    sink = CAMio.CaptureSink()
+    env = CAM.run(source, sink=sink, env=env, backend=backend)
+    return sink.getvalue(), env
+
+
+class TestSinks(unittest.TestCase):
+    def test_plain_list_collects_printed_lines(self):
+        for backend in backends:
+            with self.subTest(backend=backend):
+                printed = []
+                CAM.run('x = 6; print x; func f do print x * 7 end; call f', env={'printing': printed},
+                        backend=backend)
+                self.assertEqual(printed, ['6', '42'])
+
+
+class TestErrors(unittest.TestCase):
+    def assertFails(self, source, error, message):
+        for backend in backends:
+            with self.subTest(backend=backend):
+                sink = CAMio.CaptureSink()
+                with self.assertRaises(error) as raised:
+                    CAM.run(source, sink=sink, backend=backend)
+                self.assertIn(message, str(raised.exception))
+                self.assertEqual(sink.getvalue(), '0\n0\n')
+
+    def test_first_undefined_read_that_runs(self):
+        self.assertFails('print 0; b = 1; c = 1; s = 1; print 0; q = q + 4; c = c + b / a / q * b',
+                         RuntimeError, 'Variable not defined: q')
+
+    def test_error_before_an_undefined_read(self):
+        self.assertFails('print 0; print 0; x = 1 / 0; print y', ZeroDivisionError, 'division by zero')
+
+
+class TestFunctionsAcrossRuns(unittest.TestCase):
+    def test_function_defined_in_an_earlier_run(self):
+        for first in backends:
+            for second in backends:
+                with self.subTest(first=first, second=second):
+                    _, env = run('func f do print n; n = n + 1 end; n = 7', first)
+                    output, env = run('n = n * 10; call f; call f; print n', second, env)
+                    self.assertEqual(output, '70\n71\n72\n')
+
+    def test_vm_function_copies_only_what_it_uses(self):
+        source = 'func g do acc = acc + delta end; func f do delta = n * 2; call g end; n = 1; acc = 0; ' + \
+                 '; '.join('v%d = %d' % (i, i) for i in range(200))
+        program = CAMvm.compile_ast(CAMparser.parse(CAMlexer.lex(source)).value)
+        f = next(function for function in program.functions if function.name == 'f')
+        self.assertEqual(sorted(program.names[slot] for slot in f.slots), ['acc', 'delta', 'g', 'n'])
+        env = CAMvm.run(program, {'printing': CAMio.NullSink()})
+        _, env = run('for i = 1 to 4 do n = i; call f end', 'tree', env)
+        self.assertEqual((env['acc'], env['delta'], env['v199']), (12, 6, 199))
+
+    def test_vm_rejects_a_function_of_another_program(self):
+        define = CAMvm.compile_ast(CAMparser.parse(CAMlexer.lex('func f do print 1 end')).value)
+        call = CAMvm.compile_ast(CAMparser.parse(CAMlexer.lex('call f')).value)
+        function = next(function for function in define.functions if function.name == 'f')
+        with self.assertRaises(RuntimeError):
+            CAMvm.run(call, {'f': function, 'printing': CAMio.NullSink()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import contextlib, io, os, shutil, tempfile, unittest
+import CAM, CAMcache, CAMio, CAMlexer, CAMoptimize, CAMparser
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def source(self, text):
+        path = os.path.join(self.directory, 'program.cam')
+        with open(path, 'w') as source:
+            source.write(text)
+        return path
+
+    def main(self, path, **options):
+        sink = CAMio.CaptureSink()
+        return CAM.main(path, sink=sink, **options), sink.getvalue()
+
+    def test_illegal_character_is_reported(self):
+        path = self.source('print 1; x = 1 @ 2')
+        for cache in (False, True):
+            with self.subTest(cache=cache):
+                self.assertEqual(self.main(path, cache=cache), (None, 'Illegal character: @\n'))
+
+    def test_report_goes_to_stderr(self):
+        path = self.source('x = 2 * 3; print x')
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            env, output = self.main(path, optimize=2, report=True)
+        self.assertEqual(output.splitlines()[0], '6')
+        self.assertNotIn('constant folding', output)
+        self.assertIn('constant folding', errors.getvalue())
+
+
+class TestDiskCache(unittest.TestCase):
+    source_text = 'input n; s = 0; for i = 1 to n do s = s + i * 2 end; print s'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'program.cam')
+        self.write(self.source_text)
+
+    def write(self, text):
+        with open(self.path, 'w') as source:
+            source.write(text)
+        with open(self.path, 'rb') as source:
+            self.data = source.read()
+
+    def parsed(self, optimize=0):
+        ast = CAMparser.parse(CAMlexer.lex(self.data.decode())).value
+        return CAMoptimize.optimize(ast, optimize) if optimize else ast
+
+    def test_write_then_read_gives_the_tree_back(self):
+        for optimize in (0, 2):
+            with self.subTest(optimize=optimize):
+                ast = self.parsed(optimize)
+                self.assertTrue(CAMcache.write(self.path, self.data, ast, optimize))
+                self.assertEqual(CAMcache.read(self.path, self.data, optimize), ast)
+
+    def test_main_writes_and_reuses_the_cache(self):
+        sink = CAMio.CaptureSink()
+        CAM.main(self.path, sink=sink, inputs=[4], cache=True)
+        self.assertEqual(CAMcache.read(self.path, self.data), self.parsed())
+        cached = CAMio.CaptureSink()
+        env = CAM.main(self.path, sink=cached, inputs=[4], cache=True)
+        self.assertEqual(cached.lines, sink.lines)
+        self.assertEqual(env['s'], 12)
+
+    def test_changed_source_misses(self):
+        CAMcache.write(self.path, self.data, self.parsed())
+        self.write(self.source_text.replace('* 2', '* 3'))
+        self.assertIsNone(CAMcache.read(self.path, self.data))
+        env = CAM.main(self.path, sink=CAMio.CaptureSink(), inputs=[4], cache=True)
+        self.assertEqual(env['s'], 18)
+        self.assertEqual(CAMcache.read(self.path, self.data), self.parsed())
+
+    def test_levels_and_directories_are_kept_apart(self):
+        shared = os.path.join(self.directory, 'shared')
+        CAMcache.write(self.path, self.data, self.parsed(), 0)
+        self.assertIsNone(CAMcache.read(self.path, self.data, 2))
+        self.assertIsNone(CAMcache.read(self.path, self.data, 0, shared))
+        CAMcache.write(self.path, self.data, self.parsed(2), 2, shared)
+        self.assertEqual(CAMcache.read(self.path, self.data, 2, shared), self.parsed(2))
+        self.assertEqual(CAMcache.read(self.path, self.data, 0), self.parsed())
+
+    def test_unreadable_file_misses_and_is_replaced(self):
+        cached = CAMcache.cache_path(self.path)
+        os.makedirs(os.path.dirname(cached))
+        for contents in (b'', b'CAMC', CAMcache.magic + CAMcache.source_hash(self.data) + b'not a pickle'):
+            with self.subTest(contents=contents):
+                with open(cached, 'wb') as broken:
+                    broken.write(contents)
+                self.assertIsNone(CAMcache.read(self.path, self.data))
+                CAM.main(self.path, sink=CAMio.CaptureSink(), inputs=[4], cache=True)
+                self.assertEqual(CAMcache.read(self.path, self.data), self.parsed())
+
+
+class TestProgramCache(unittest.TestCase):
+    def test_hit_returns_the_same_program(self):
+        cache = CAM.ProgramCache()
+        program = CAM.compile('x = 1; print x', 'vm', cache=cache)
+        self.assertIs(CAM.compile('x = 1; print x', 'vm', cache=cache), program)
+        self.assertIsNot(CAM.compile('x = 1; print x', 'tree', cache=cache), program)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        evicted = []
+        cache = CAM.ProgramCache(maxsize=2, on_evict=evicted.append)
+        for source in ('print 1', 'print 2', 'print 1', 'print 3'):
+            CAM.compile(source, cache=cache)
+        self.assertEqual([program.source for program in evicted], ['print 2'])
+        self.assertEqual(len(cache), 2)
+
+    def test_resize_keeps_the_limit_not_given(self):
+        cache = CAM.ProgramCache(maxsize=8, maxbytes=1 << 20)
+        cache.resize(maxsize=4)
+        self.assertEqual((cache.maxsize, cache.maxbytes), (4, 1 << 20))
+        cache.resize(maxbytes=None)
+        self.assertEqual((cache.maxsize, cache.maxbytes), (4, None))
+        for source in ('print 1', 'print 2', 'print 3'):
+            CAM.compile(source, cache=cache)
+        cache.resize(maxsize=1)
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import random, unittest
+import CAMlexer, CAMparser
+from CAMdocument import Document, openers
+
+fragments = ['x = 1', 'y = x + 2 * 3', '; ', ';', 'print y', 'if x < 2 then ', ' end', 'end', 'while x < 3 do ',
+             'x = x + 1', 'func f do ', 'call f', 'for i = 1 to 4 do ', '@', '\n', ' ', '# note\n', '"s"', '(', ')']
+statement_texts = ['x = 1', 'print x + 2', 'if x < 2 then y = 1; print y else print 0 end', 'call f',
+                   'while x < 3 do x = x + 1 end', 'for i = 1 to 4 do print i end', 'func g do print "s" end']
+start_text = 'x = 1;\nif x < 2 then print x else print 0 end;\nfunc f do y = y + 1 end;\nwhile x < 3 do x = x + 1 end'
+
+
+# The top-level statements of text as (start, [(text, tag)], [offset]), found
+# by lexing the whole text, with the splitting rules Document keeps to: a
+# ';' outside every block ends a statement, and one with nothing before it
+# or at the end of the text leaves an empty statement
+def statements(text):
+    found = []
+    segment = None
+    depth = 0
+    separated = False
+    pos = 0
+    while pos < len(text):
+        match = CAMlexer.masterExpression.match(text, pos)
+        if match is None:
+            token, start, tag, pos = text[pos], pos, None, pos + 1
+        else:
+            token, start, tag, pos = match.group(), match.start(), CAMlexer.groupTags[match.lastgroup], match.end()
+            if not tag:
+                continue
+            if tag is CAMlexer.RESERVED and token == ';' and depth == 0:
+                if segment is None:
+                    # An empty statement, which does not parse
+                    found.append((start, [], []))
+                segment = None
+                separated = True
+                continue
+            if tag is CAMlexer.RESERVED and token in openers:
+                depth += 1
+            elif tag is CAMlexer.RESERVED and token == 'end' and depth:
+                depth -= 1
+        if segment is None:
+            segment = (start, [], [])
+            found.append(segment)
+            separated = False
+        segment[1].append((token, tag))
+        segment[2].append(start - segment[0])
+    if separated:
+        found.append((len(text), [], []))
+    return found
+
+
+def parsed(text):
+    try:
+        tokens = CAMlexer.lex_buffer(text)
+    except RuntimeError:
+        return None
+    result = CAMparser.parse(tokens)
+    return result.value if result else None
+
+
+class TestDocument(unittest.TestCase):
+    def assertMatchesFullParse(self, doc):
+        expected = statements(doc.text)
+        self.assertEqual([(doc.start(index), segment.tokens, list(segment.offsets))
+                          for index, segment in enumerate(doc.segments)], expected)
+        self.assertEqual(doc.ast, parsed(doc.text))
+
+    def test_random_edits(self):
+        generator = random.Random(1234)
+        for trial in range(40):
+            doc = Document(start_text)
+            for step in range(60):
+                offset = generator.randint(0, len(doc.text))
+                removed = generator.randint(0, min(8, len(doc.text) - offset)) if generator.random() < 0.5 else 0
+                inserted = ''.join(generator.choice(fragments) for _ in range(generator.randint(0, 2)))
+                doc.edit(offset, removed, inserted)
+                with self.subTest(trial=trial, step=step, text=doc.text):
+                    self.assertMatchesFullParse(doc)
+
+    # Whole statements added and removed at statement boundaries and digits
+    # changed, so most states parse
+    def test_random_statement_edits(self):
+        generator = random.Random(4321)
+        parses = 0
+        for trial in range(20):
+            doc = Document(start_text)
+            for step in range(40):
+                choice = generator.random()
+                count = len(doc.segments)
+                if choice < 0.4 or count < 2:
+                    offset = doc.start(generator.randrange(count)) if count else 0
+                    doc.edit(offset, 0, generator.choice(statement_texts) + ';\n')
+                elif choice < 0.7:
+                    index = generator.randrange(count - 1)
+                    doc.edit(doc.start(index), doc.start(index + 1) - doc.start(index), '')
+                else:
+                    digits = [pos for pos, character in enumerate(doc.text) if character.isdigit()]
+                    if digits:
+                        doc.edit(generator.choice(digits), 1, str(generator.randrange(10)))
+                with self.subTest(trial=trial, step=step, text=doc.text):
+                    self.assertMatchesFullParse(doc)
+                parses += doc.ast is not None
+        self.assertGreater(parses, 400)
+
+    def test_illegal_character(self):
+        doc = Document('x = 1; y = 2; z = 3')
+        doc.edit(9, 0, '@')
+        self.assertMatchesFullParse(doc)
+        self.assertEqual(len(doc.errors), 1)
+        doc.edit(9, 1, '')
+        self.assertMatchesFullParse(doc)
+        self.assertEqual(doc.errors, [])
+
+    def test_trailing_semicolon(self):
+        doc = Document('x = 1; y = 2')
+        doc.edit(len(doc.text), 0, ';')
+        self.assertMatchesFullParse(doc)
+        self.assertEqual((len(doc.segments), doc.ast), (3, None))
+        doc.edit(len(doc.text), 0, ' print y')
+        self.assertMatchesFullParse(doc)
+        self.assertIsNotNone(doc.ast)
+
+    def test_adding_and_removing_end(self):
+        doc = Document('x = 1; if x < 2 then y = 1; z = 2 end; print z; print y')
+        self.assertEqual(len(doc.segments), 4)
+        end = doc.text.index(' end')
+        doc.edit(end, 4, '')
+        self.assertMatchesFullParse(doc)
+        self.assertEqual(len(doc.segments), 2)
+        doc.edit(end, 0, ' end')
+        self.assertMatchesFullParse(doc)
+        self.assertEqual(len(doc.segments), 4)
+        doc.edit(doc.text.index('y = 1;') + 5, 0, ' end')
+        self.assertMatchesFullParse(doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import io, unittest
+import CAMio
+
+lines_text = 'first\r\n\r\n 7 \n+5\r\n1_000\ncafé\r\n-12\nlast'
+expected_values = ['first', '', 7, 5, 1000, 'café', -12, 'last']
+
+
+def read_all(source):
+    values = []
+    while True:
+        try:
+            values.append(source.read_value())
+        except EOFError:
+            return values
+
+
+class TestStreamInput(unittest.TestCase):
+    def test_every_chunk_size(self):
+        for chunk_size in range(1, len(lines_text) + 2):
+            for stream in (io.StringIO(lines_text), io.BytesIO(lines_text.encode())):
+                with self.subTest(chunk_size=chunk_size, stream=stream.__class__.__name__):
+                    self.assertEqual(read_all(CAMio.StreamInput(stream, chunk_size)), expected_values)
+
+    def test_crlf_split_between_chunks(self):
+        text = 'ab\r\ncd\r\n'
+        cut = text.index('\n')
+        for stream in (io.StringIO(text), io.BytesIO(text.encode())):
+            with self.subTest(stream=stream.__class__.__name__):
+                source = CAMio.StreamInput(stream, cut)
+                self.assertEqual(read_all(source), ['ab', 'cd'])
+
+    def test_final_line_with_and_without_newline(self):
+        for text, values in (('1\n2', [1, 2]), ('1\n2\n', [1, 2]), ('', []), ('\n', ['']), ('x', ['x'])):
+            with self.subTest(text=text):
+                self.assertEqual(read_all(CAMio.StreamInput(io.StringIO(text), 1)), values)
+                self.assertEqual(read_all(CAMio.provider(text.encode())), values)
+
+    def test_eof_once_input_runs_out(self):
+        source = CAMio.StreamInput(io.BytesIO(b'4\n'))
+        self.assertEqual(source.read_value(), 4)
+        for _ in range(2):
+            with self.assertRaises(EOFError):
+                source.read_value()
+
+    def test_multibyte_character_split_between_chunks(self):
+        data = 'é\nñ\n'.encode()
+        for chunk_size in range(1, len(data) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(read_all(CAMio.StreamInput(io.BytesIO(data), chunk_size)), ['é', 'ñ'])
+
+
+class TestParseValue(unittest.TestCase):
+    def test_matches_int(self):
+        for line in (' 7 ', '+5', '-5', '1_000', '0', '007', '٣', '١٢', '７', '²',
+                     '1__0', '_1', '1_', '1.5', '', ' ', '+', '12a', 'x', '\t42\t'):
+            with self.subTest(line=line):
+                try:
+                    expected = int(line)
+                except ValueError:
+                    expected = line
+                value = CAMio.parse_value(line)
+                self.assertEqual((type(value), value), (type(expected), expected))
+
+
+class TestProvider(unittest.TestCase):
+    def test_sources(self):
+        self.assertEqual(read_all(CAMio.provider('1\nx\n')), [1, 'x'])
+        self.assertEqual(read_all(CAMio.provider(b'1\nx\n')), [1, 'x'])
+        self.assertEqual(read_all(CAMio.provider(io.StringIO('1\nx\n'))), [1, 'x'])
+        self.assertEqual(read_all(CAMio.provider([1, ' 2 ', b'3', 'y', 4.5])), [1, 2, 3, 'y', 4.5])
+        values = CAMio.ValueInput([])
+        self.assertIs(CAMio.provider(values), values)
+
+    def test_read_input_uses_the_provider(self):
+        env = {'input': CAMio.provider(['9']), 'printing': CAMio.CaptureSink()}
+        self.assertEqual(CAMio.read_input(env), 9)
+        with self.assertRaises(EOFError):
+            CAMio.read_input(env)
+
+
+if __name__ == '__main__':
+    unittest.main()
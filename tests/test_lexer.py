@@ -0,0 +1,42 @@
+import unittest
+from concurrent import futures
+import CAMlexer
+
+source = ''.join('x%d = %d * (y + "s") - 7; # note %d\nif x%d <= 3 then print x%d end;\n' % ((n,) * 5)
+                 for n in range(300))
+
+
+def columns(buffer):
+    return buffer.tags, buffer.starts, buffer.ends
+
+
+class TestParallelLexer(unittest.TestCase):
+    def test_pool_matches_lex_buffer(self):
+        expected = columns(CAMlexer.lex_buffer(source))
+        with futures.ProcessPoolExecutor(2) as executor:
+            for chunk_size in (1, 100, 4096, len(source)):
+                with self.subTest(chunk_size=chunk_size):
+                    buffer = CAMlexer.lex_parallel(source, 2, executor, threshold=0, chunk_size=chunk_size)
+                    self.assertEqual(columns(buffer), expected)
+                    self.assertEqual(list(buffer), list(CAMlexer.lex_buffer(source)))
+
+    def test_own_pool_matches_lex_buffer(self):
+        buffer = CAMlexer.lex_parallel(source, 2, threshold=0, chunk_size=1000)
+        self.assertEqual(columns(buffer), columns(CAMlexer.lex_buffer(source)))
+
+    def test_short_source_is_lexed_serially(self):
+        class Refuse:
+            def map(self, *arguments):
+                raise AssertionError('a pool was used')
+
+        buffer = CAMlexer.lex_parallel(source, 2, Refuse())
+        self.assertEqual(columns(buffer), columns(CAMlexer.lex_buffer(source)))
+
+    def test_illegal_character_in_a_chunk(self):
+        with futures.ProcessPoolExecutor(2) as executor:
+            with self.assertRaises(RuntimeError):
+                CAMlexer.lex_parallel(source + 'x = 1 @ 2\n', 2, executor, threshold=0, chunk_size=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
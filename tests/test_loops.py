@@ -0,0 +1,127 @@
+import unittest
+import CAMio, CAMlexer, CAMloops, CAMoptimize, CAMparser
+from CAMast import ReducedLoop
+
+# Programs the loop analyser turns into plans, each with its loop bounds
+# wide enough to pass closed_form_threshold
+integer_programs = [
+    's = 0; for i = 1 to 2000 do s = s + i end; print s',
+    's = 5; t = 0; for i = 3 to 903 do s = s + i * i - 2 * i + 7; t = t - i * i * i end; print s; print t',
+    'k = 3; s = 0; for i = 0 - 50 to 400 do s = s + k * i * i * i * i; v = i * k - 1 end; print s; print v',
+    's = 0; for i = 1 to 5000 do s = s + 4503599627370496 * i end; print s',
+]
+# Past max_degree the plan gives up and the loop runs
+high_degree_programs = [
+    's = 0; for i = 1 to 100 do s = s + i * i * i * i * i * i * i * i * i * i end; print s',
+]
+float_programs = [
+    's = 0; for i = 1 to 3000 do s = s + i / 7 end; print s',
+    's = 0; for i = 1 to 3000 do s = s + 1 / i - i / 3 end; print s',
+    'x = 2; for i = 0 to 100 do s = x * i / 3; r = i / 4 end; print s; print r',
+    'x = 1; s = 0; h = x / 10; for i = 1 to 500 do s = s + h * i end; print s',
+]
+division_by_zero_programs = [
+    's = 0; for i = 1 to 3000 do s = s + 100 / (i - 1500) end; print s',
+    'for i = 1 to 3000 do r = 7 / (i - 2999) end; print r',
+    's = 0; for i = 1 to 3000 do s = s + i / 0 end',
+]
+short_programs = [
+    's = 0; for i = 1 to 16 do s = s + i * i end; print s; print i',
+    's = 0; for i = 5 to 5 do s = s + i end; print s',
+    's = 0; for i = 9 to 1 do s = s + i end; print s',
+    's = 0; n = 10; for i = 0 to n do s = s + i / 3 end; print s',
+]
+string_programs = [
+    't = "ab"; s = "x"; for i = 1 to 100 do s = s + t end; print s',
+    't = "ab"; for i = 1 to 100 do v = t end; print v',
+    't = "ab"; s = 0; for i = 1 to 100 do s = s + t end',
+]
+
+
+def parsed(source, level):
+    ast = CAMparser.parse(CAMlexer.lex(source)).value
+    return CAMoptimize.optimize(ast, level) if level else ast
+
+
+# What running ast leaves behind: its output, its variables and the type of
+# the error it stopped with
+def outcome(ast):
+    sink = CAMio.CaptureSink()
+    env = {'printing': sink}
+    error = None
+    try:
+        ast.eval(env)
+    except Exception as raised:
+        error = raised.__class__
+    del env['printing']
+    return sink.lines, env, error
+
+
+# Runs the top-level statements of ast against env, running the plans of its
+# reduced loops on their own, and returns what each plan's run returned
+def run_plans(ast, env):
+    ran = []
+    for statement in ast.statements:
+        if isinstance(statement, ReducedLoop):
+            ran.append(statement.plan.run(env))
+            if not ran[-1]:
+                break
+        else:
+            statement.eval(env)
+    return ran
+
+
+class TestLoopPlans(unittest.TestCase):
+    def assertSameAsEval(self, programs):
+        for source in programs:
+            with self.subTest(source=source):
+                self.assertEqual(outcome(parsed(source, 2)), outcome(parsed(source, 0)))
+
+    def test_integer_polynomial_sums(self):
+        self.assertSameAsEval(integer_programs + high_degree_programs)
+
+    def test_integer_sums_run_in_closed_form(self):
+        for source in integer_programs:
+            with self.subTest(source=source):
+                sink = CAMio.CaptureSink()
+                self.assertEqual(run_plans(parsed(source, 2), {'printing': sink}), [True])
+                self.assertEqual(sink.lines, outcome(parsed(source, 0))[0])
+
+    def test_float_and_division_terms(self):
+        self.assertSameAsEval(float_programs)
+
+    def test_division_by_zero_partway(self):
+        self.assertSameAsEval(division_by_zero_programs)
+        for source in division_by_zero_programs:
+            self.assertEqual(outcome(parsed(source, 2))[2], ZeroDivisionError)
+
+    def test_loops_under_the_threshold(self):
+        self.assertSameAsEval(short_programs)
+        for source in short_programs:
+            with self.subTest(source=source):
+                self.assertNotIn(True, run_plans(parsed(source, 2), {'printing': CAMio.NullSink()}))
+
+    def test_string_operands(self):
+        self.assertSameAsEval(string_programs)
+        for source in string_programs[:2]:
+            with self.subTest(source=source):
+                self.assertEqual(run_plans(parsed(source, 2), {'printing': CAMio.NullSink()}), [False])
+
+
+@unittest.skipUnless(CAMloops.numpy, 'NumPy is not installed')
+class TestNumpyPlans(unittest.TestCase):
+    def test_float_sums_run_on_numpy(self):
+        for source in float_programs:
+            with self.subTest(source=source):
+                sink = CAMio.CaptureSink()
+                self.assertEqual(run_plans(parsed(source, 2), {'printing': sink}), [True])
+                self.assertEqual(sink.lines, outcome(parsed(source, 0))[0])
+
+    def test_division_by_zero_falls_back_to_the_loop(self):
+        for source in division_by_zero_programs:
+            with self.subTest(source=source):
+                self.assertEqual(run_plans(parsed(source, 2), {'printing': CAMio.NullSink()}), [False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio, threading, unittest
+import CAM, CAMio, CAMlexer, CAMparser, CAMoptimize, CAMasync, CAMstepper
+from CAMast import invariants_key
+from streams import Lines, Output
+
+# A loop whose invariant, a + a, differs from run to run
+invariant_program = 'input a; s = 0; w = 0; while w < 2000 do s = s + a * 2; w = w + 1 end; print s'
+
+
+def optimized(source, level=2):
+    return CAMoptimize.optimize(CAMparser.parse(CAMlexer.lex(source)).value, level)
+
+
+class TestInvariants(unittest.TestCase):
+    def test_optimizer_hoists_the_invariant(self):
+        self.assertIn('HoistedLoop', repr(optimized(invariant_program)))
+
+    def test_interleaved_async_runs_of_one_tree(self):
+        ast = optimized(invariant_program)
+
+        async def run_all():
+            outputs = [Output() for _ in range(3)]
+            await asyncio.gather(*[CAMasync.run_async(ast, Lines([str(a)]), output, slice_steps=7)
+                                   for a, output in zip((1, 2, 3), outputs)])
+            return [output.written for output in outputs]
+
+        self.assertEqual(asyncio.run(run_all()), [b'4000\n', b'8000\n', b'12000\n'])
+
+    def test_interleaved_stepper_runs_of_one_tree(self):
+        ast = optimized(invariant_program)
+        machines = [CAMstepper.Machine(ast, {"input": CAMio.ValueInput([a]), "printing": CAMio.CaptureSink()})
+                    for a in (1, 2, 3)]
+        while not all(machine.finished for machine in machines):
+            for machine in machines:
+                machine.run(5)
+        self.assertEqual([machine.env["printing"].lines for machine in machines], [['4000'], ['8000'], ['12000']])
+        for machine in machines:
+            self.assertNotIn(invariants_key, machine.env)
+
+    def test_concurrent_runs_of_one_program(self):
+        for backend in ('tree', 'stepper', 'vm', 'python'):
+            program = CAM.compile(invariant_program, backend, optimize=2, cache=None)
+            results = {}
+
+            def run(a):
+                sink = CAMio.CaptureSink()
+                for _ in range(20):
+                    program.run([a], sink)
+                results[a] = set(sink.lines)
+
+            threads = [threading.Thread(target=run, args=(a,)) for a in range(1, 9)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, dict((a, {str(4000 * a)}) for a in range(1, 9)), backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
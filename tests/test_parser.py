@@ -0,0 +1,88 @@
+import itertools, unittest
+import CAMlexer, CAMparser
+from combinators import Instrumented
+
+sources = [
+    'x = 1',
+    'x = 1 + 2 * 3 - 4 / 5; y = (1 + 2) * (3 - x) / 2 - 1',
+    'a = 8 - 3 - 2; b = 64 / 4 / 2; c = a * b + a / b * 3',
+    'if x < 1 and y >= 2 or not z == 3 then print x else print "done" end',
+    'if (x < 1 or y > 2) and (not (z != 3)) then x = 1 end',
+    'while i <= 10 do i = i + 1; if i > 5 then print i end end',
+    'for i = 1 to n * 2 do s = s + i * i end; print s',
+    'func f do n = n - 1; if n > 0 then call f end end; n = 3; call f',
+    'input a; input b; print a + b; print "sum"',
+    '# a comment\nx = 1;\n# another\nprint x',
+]
+
+engines = [
+    ('combinator', lambda tokens: CAMparser.parse(tokens)),
+    ('packrat', lambda tokens: CAMparser.parse(tokens, packrat=True)),
+    ('pratt', lambda tokens: CAMparser.parse(tokens, engine='pratt')),
+]
+
+
+class TestEngines(unittest.TestCase):
+    def test_engines_build_equal_trees(self):
+        for source in sources:
+            expected = CAMparser.parse(CAMlexer.lex(source))
+            self.assertIsNotNone(expected, source)
+            for name, parse in engines:
+                for tokens in (CAMlexer.lex(source), CAMlexer.lex_buffer(source),
+                               CAMlexer.TokenStream(CAMlexer.lex_iter(source))):
+                    with self.subTest(source=source, engine=name, tokens=tokens.__class__.__name__):
+                        result = parse(tokens)
+                        self.assertIsNotNone(result)
+                        self.assertEqual(result.value, expected.value)
+                        self.assertEqual(repr(result.value), repr(expected.value))
+
+    def test_engines_reject_the_same_programs(self):
+        for source in ('x = ', 'if x then print x end', 'x = (1 + 2', 'while x < 1 do end', 'print 1 print 2'):
+            for name, parse in engines:
+                with self.subTest(source=source, engine=name):
+                    self.assertIsNone(parse(CAMlexer.lex(source)))
+
+
+class TestInstrumented(unittest.TestCase):
+    # (calls, successes, failures, repeats, backtracked, memo hits) by rule
+    def counts(self, source, packrat=False):
+        tokens = Instrumented(CAMlexer.lex(source), packrat, clock=itertools.count().__next__)
+        result = CAMparser.parse(tokens)
+        self.assertEqual(result.value, CAMparser.parse(CAMlexer.lex(source)).value)
+        return tokens, dict((name, (stats.calls, stats.successes, stats.failures, stats.repeats, stats.backtracked,
+                                    stats.memo_hits)) for name, stats in tokens.rules.items())
+
+    # The relop alternative takes '(' for an arithmetic group, reads up to
+    # the '<' where it wants ')', and fails; the boolean group then parses
+    # the same x again
+    def test_group_that_backtracks(self):
+        tokens, counts = self.counts('if (x < 1) then y = 1 end')
+        self.assertEqual(counts['bexp_relop'], (2, 1, 1, 0, 3, 0))
+        self.assertEqual(counts['aexp_group'], (1, 0, 1, 0, 3, 0))
+        self.assertEqual(counts['bexp_group'], (1, 1, 0, 0, 0, 0))
+        self.assertEqual(counts['aexp'], (5, 4, 1, 1, 3, 0))
+        self.assertEqual(counts['aexp_value'], (4, 4, 0, 1, 0, 0))
+
+    def test_packrat_serves_the_repeat_from_the_memo(self):
+        tokens, counts = self.counts('if (x < 1) then y = 1 end', packrat=True)
+        self.assertEqual(counts['aexp'], (4, 3, 1, 0, 3, 1))
+        self.assertEqual(counts['aexp_value'], (3, 3, 0, 0, 0, 0))
+        self.assertGreater(sum(stats.memo_hits for stats in tokens.rules.values()), 0)
+        self.assertIn('memo hits: 1', tokens.report())
+
+    def test_group_that_does_not_backtrack(self):
+        tokens, counts = self.counts('if (x) < 1 then y = 1 end')
+        self.assertEqual(counts['bexp_relop'], (1, 1, 0, 0, 0, 0))
+        self.assertEqual(counts['aexp_group'], (1, 1, 0, 0, 0, 0))
+        self.assertEqual(sum(failures for calls, successes, failures, *rest in counts.values()), 0)
+
+    def test_time_is_inclusive_and_self_time_is_not(self):
+        tokens, counts = self.counts('if (x < 1) then y = 1 end')
+        rules = tokens.rules
+        self.assertGreater(rules['stmt_list'].time, rules['if_stmt'].time)
+        self.assertGreater(rules['if_stmt'].time, rules['if_stmt'].self_time)
+        self.assertGreater(rules['if_stmt'].self_time, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
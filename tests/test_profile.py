@@ -0,0 +1,44 @@
+import itertools, unittest
+import CAMlexer, CAMparser, CAMprofile
+
+nested_program = '''func f do x = 1 end;
+func g do
+y = 2;
+call f end;
+call g'''
+
+
+# A clock that moves on a millisecond every time it is read
+def ticking():
+    return itertools.count(0.0, 0.001).__next__
+
+
+class TestProfile(unittest.TestCase):
+    def profile(self, source):
+        machine = CAMprofile.ProfilingMachine(CAMparser.parse(CAMlexer.lex_buffer(source)).value, clock=ticking())
+        machine.run()
+        return machine
+
+    def test_collapsed_stacks_of_nested_calls(self):
+        machine = self.profile(nested_program)
+        stacks = [line.rsplit(' ', 1)[0] for line in machine.collapsed().splitlines()]
+        self.assertEqual(stacks, ['<main>;call g:5', '<main>;func:1', '<main>;func:2', '<main>;g;assign:3',
+                                  '<main>;g;call f:4', '<main>;g;f;assign:1'])
+
+    def test_func_totals_include_their_callees(self):
+        machine = self.profile(nested_program)
+        g, f = machine.functions['g'], machine.functions['f']
+        self.assertEqual((g.calls, f.calls), (1, 1))
+        self.assertGreater(g.total, f.total)
+        call_g = next(stats for stats in machine.statements.values() if CAMprofile.label(stats.node) == 'call g:5')
+        self.assertEqual(call_g.total, g.total)
+
+    def test_recursive_func_counts_the_outermost_call(self):
+        machine = self.profile('func f do n = n - 1; if n > 0 then call f end end; n = 3; call f')
+        self.assertEqual(machine.functions['f'].calls, 3)
+        self.assertEqual(machine.env['n'], 0)
+        self.assertEqual(machine.calls, ['<main>'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import io, unittest
+import CAM, CAMlexer, CAMparser, CAMresolve
+from CAMresolve import Undefined
+
+
+def resolved(source):
+    return CAMresolve.resolve(CAMparser.parse(CAMlexer.lex_buffer(source)).value)
+
+
+class TestUndefined(unittest.TestCase):
+    def test_reads_nothing_assigns(self):
+        resolution = resolved('print 0; b = 1;\nq = q + 4; c = b / a;\nif z > 0 then print a end')
+        self.assertEqual(resolution.undefined, [Undefined('a', 2, 12), Undefined('z', 3, 1), Undefined('a', 3, 15)])
+
+    def test_assigned_anywhere_is_not_reported(self):
+        for source in ('print x; x = 1', 'func f do print y end; input y; call f',
+                       'for i = 1 to 3 do print i end; print i', 'if 1 < 2 then v = 1 else print v end'):
+            with self.subTest(source=source):
+                self.assertEqual(resolved(source).undefined, [])
+
+    def test_warning_does_not_stop_the_run(self):
+        stream = io.StringIO()
+        ast = CAMparser.parse(CAMlexer.lex_buffer('print 1;\nprint missing')).value
+        CAM.warn_undefined(ast, stream)
+        self.assertEqual(stream.getvalue(), 'warning: line 2, column 1: missing is read but never assigned\n')
+        printed = []
+        env = CAM.run('print 1; if 0 > 1 then print missing end', env={'printing': printed}, backend='vm')
+        self.assertEqual(printed, ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()